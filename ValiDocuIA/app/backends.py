@@ -0,0 +1,288 @@
+# backends.py — backends de inferencia CPU para LayoutLMv3 (eager fp32, INT8 dinámico, ONNX Runtime)
+# -----------------------------------------------------------------------------
+# PRED_BACKEND elige cómo corre el forward del modelo residente:
+#   - eager: LayoutLMv3ForTokenClassification en fp32 (como siempre);
+#   - int8:  torch.ao.quantization.quantize_dynamic sobre las capas Linear (pesos INT8,
+#            activaciones cuantizadas al vuelo);
+#   - onnx:  grafo exportado (uno con rama visual y otro solo texto + layout) ejecutado
+#            con ONNX Runtime (CPUExecutionProvider).
+# Un backend distinto de eager solo se activa si app.validar_backend comprobó que las
+# entidades coinciden con las del modelo fp32 en un conjunto de páginas de referencia. La
+# validación queda en <PRED_BACKEND_DIR>/<backend>.json junto con la versión del checkpoint
+# y la firma de los artefactos; si algo cambió (checkpoint, grafo exportado, versión de
+# torch/onnxruntime) se vuelve a eager hasta validar de nuevo.
+# Los backends alternativos son solo CPU: con CUDA se usa siempre eager.
+#
+# PRED_COMPILE (solo backends torch) compila el forward para la forma fija de max_length:
+#   - compile: torch.compile(dynamic=False), recompila por cada forma nueva;
+#   - trace:   torch.jit.trace + freeze, un grafo por (modo, filas) trazado la primera vez
+#              que aparece esa forma; otras longitudes de secuencia usan el modelo sin compilar.
+# La compilación ocurre en el calentamiento de prediccion.get_model, antes de servir.
+# -----------------------------------------------------------------------------
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import torch
+
+from app import topology
+
+# ======== Config (override por ENV) ========
+PRED_BACKEND     = os.getenv("PRED_BACKEND", "eager")
+PRED_BACKEND_DIR = os.getenv("PRED_BACKEND_DIR", "")       # vacío = <MODEL_DIR>/backends
+ONNX_OPSET       = int(os.getenv("ONNX_OPSET", "17"))
+PRED_COMPILE     = os.getenv("PRED_COMPILE", "")           # "" | compile | trace
+
+BACKENDS = ("eager", "int8", "onnx")
+
+# grafo por modo: con pixel_values (completo) y sin ellos (texto)
+ONNX_FILES = {False: "layoutlmv3.onnx", True: "layoutlmv3_texto.onnx"}
+
+
+def _log(*a):
+    print("[backends]", *a, flush=True)
+
+
+def backend_dir(model_root: str) -> str:
+    return PRED_BACKEND_DIR or os.path.join(model_root, "backends")
+
+
+def _marker_path(model_root: str, name: str) -> str:
+    return os.path.join(backend_dir(model_root), f"{name}.json")
+
+
+def signature(model_root: str, name: str) -> str:
+    """Lo que además del checkpoint determina la salida de un backend."""
+    if name == "int8":
+        return f"torch={torch.__version__}"
+    if name == "onnx":
+        parts = []
+        for text_only in (False, True):
+            path = os.path.join(backend_dir(model_root), ONNX_FILES[text_only])
+            if not os.path.isfile(path):
+                return ""
+            st = os.stat(path)
+            parts.append(f"{ONNX_FILES[text_only]}:{st.st_size}:{st.st_mtime_ns}")
+        try:
+            import onnxruntime
+            parts.append(f"onnxruntime={onnxruntime.__version__}")
+        except ImportError:
+            return ""
+        return ";".join(parts)
+    return ""
+
+
+def resolve(model_root: str, name: str, checkpoint_version: str) -> str:
+    """Backend que realmente se activa: `name` si está validado para este checkpoint, si no eager."""
+    if name == "eager":
+        return name
+    if name not in BACKENDS:
+        _log(f"AVISO: PRED_BACKEND={name} desconocido ({', '.join(BACKENDS)}); usando eager")
+        return "eager"
+    try:
+        with open(_marker_path(model_root, name), "r", encoding="utf-8") as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        _log(f"AVISO: backend {name} sin validar (falta {_marker_path(model_root, name)}); usando eager")
+        return "eager"
+    if not marker.get("ok"):
+        _log(f"AVISO: la validación de {name} no pasó ({marker.get('diferencias')} diferencias); usando eager")
+        return "eager"
+    if marker.get("version") != checkpoint_version or marker.get("firma") != signature(model_root, name):
+        _log(f"AVISO: la validación de {name} es de otro checkpoint/artefacto; usando eager")
+        return "eager"
+    return name
+
+
+def write_marker(model_root: str, name: str, checkpoint_version: str, reporte: Dict[str, Any]) -> str:
+    path = _marker_path(model_root, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    marker = {
+        "backend": name,
+        "version": checkpoint_version,
+        "firma": signature(model_root, name),
+        "validado_en": datetime.now().isoformat(timespec="seconds"),
+        **reporte,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(marker, f, indent=2, ensure_ascii=False)
+    return path
+
+
+# ======== INT8 dinámico ========
+def quantize_int8(model: torch.nn.Module) -> torch.nn.Module:
+    """Copia del modelo con las capas Linear cuantizadas a INT8 (el fp32 original no se toca)."""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=False)
+
+
+# ======== ONNX ========
+class _Exportable(torch.nn.Module):
+    """Forward posicional para torch.onnx.export; sin pixel_values exporta el grafo solo texto."""
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, bbox, attention_mask, *pixel_values):
+        return self.model(input_ids=input_ids, bbox=bbox, attention_mask=attention_mask,
+                          pixel_values=pixel_values[0] if pixel_values else None).logits
+
+
+@torch.no_grad()
+def export_onnx(model: torch.nn.Module, processor, model_root: str, max_length: int) -> Dict[bool, str]:
+    """
+    Exporta ambos grafos (completo y solo texto) a backend_dir(model_root). Borra la validación
+    previa de onnx: un grafo recién exportado no se activa hasta validarlo.
+    """
+    from PIL import Image
+
+    out_dir = backend_dir(model_root)
+    os.makedirs(out_dir, exist_ok=True)
+    try:
+        os.remove(_marker_path(model_root, "onnx"))
+    except FileNotFoundError:
+        pass
+
+    # dos filas para que el eje batch no quede fijo a 1
+    enc = processor.tokenizer(
+        [["ejemplo", "de", "exportación"]] * 2, boxes=[[[10, 10, 90, 30]] * 3] * 2,
+        truncation=True, padding="max_length", max_length=max_length, return_tensors="pt"
+    )
+    pixel_values = processor.image_processor(Image.new("RGB", (850, 1100), "white"),
+                                             return_tensors="pt")["pixel_values"].repeat(2, 1, 1, 1)
+    wrapper = _Exportable(model.cpu().eval())
+    names = ["input_ids", "bbox", "attention_mask"]
+    axes = {"input_ids": {0: "batch", 1: "seq"}, "bbox": {0: "batch", 1: "seq"},
+            "attention_mask": {0: "batch", 1: "seq"}, "logits": {0: "batch", 1: "seq"}}
+    paths = {}
+    for text_only, fname in ONNX_FILES.items():
+        args = (enc["input_ids"], enc["bbox"], enc["attention_mask"])
+        input_names = list(names)
+        dynamic_axes = dict(axes)
+        if not text_only:
+            args = args + (pixel_values,)
+            input_names.append("pixel_values")
+            dynamic_axes["pixel_values"] = {0: "batch"}
+        path = os.path.join(out_dir, fname)
+        torch.onnx.export(wrapper, args, path, input_names=input_names, output_names=["logits"],
+                          dynamic_axes=dynamic_axes, opset_version=ONNX_OPSET, do_constant_folding=True)
+        _log(f"exportado {path}")
+        paths[text_only] = path
+    return paths
+
+
+class _Output:
+    """Lo único que prediccion lee de la salida del modelo."""
+
+    def __init__(self, logits: torch.Tensor):
+        self.logits = logits
+
+
+class OnnxModel:
+    """
+    Sustituto de LayoutLMv3ForTokenClassification: model(**enc_in).logits con las mismas
+    entradas. Elige el grafo según haya o no pixel_values; cada sesión se abre la primera vez.
+    """
+
+    def __init__(self, model_root: str, threads: Optional[int] = None):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise RuntimeError(f"onnxruntime no está instalado: {e}")
+        self._ort = onnxruntime
+        self._dir = backend_dir(model_root)
+        # presupuesto de hilos de app.topology (el de torch por forward, u ORT_THREADS)
+        self._threads = topology.ort_threads() if threads is None else threads
+        self._sessions: Dict[bool, Any] = {}
+
+    def _session(self, text_only: bool):
+        sess = self._sessions.get(text_only)
+        if sess is None:
+            path = os.path.join(self._dir, ONNX_FILES[text_only])
+            if not os.path.isfile(path):
+                raise RuntimeError(f"grafo ONNX no encontrado: {path}")
+            opts = self._ort.SessionOptions()
+            opts.graph_optimization_level = self._ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if self._threads > 0:
+                opts.intra_op_num_threads = self._threads
+            # un solo equipo de hilos por sesión: el paralelismo entre forwards ya lo pone el scheduler
+            opts.inter_op_num_threads = 1
+            opts.execution_mode = self._ort.ExecutionMode.ORT_SEQUENTIAL
+            sess = self._sessions[text_only] = self._ort.InferenceSession(
+                path, opts, providers=["CPUExecutionProvider"])
+        return sess
+
+    def __call__(self, **inputs: Optional[torch.Tensor]) -> _Output:
+        text_only = inputs.get("pixel_values") is None
+        sess = self._session(text_only)
+        # pixel_values llega como vista expandida (stride 0): ORT necesita memoria contigua
+        feed = {i.name: np.ascontiguousarray(inputs[i.name].cpu().numpy()) for i in sess.get_inputs()}
+        logits = sess.run(["logits"], feed)[0]
+        return _Output(torch.from_numpy(logits))
+
+
+def build(model: torch.nn.Module, model_root: str, name: str):
+    """Modelo a usar en el forward para el backend `name` (eager devuelve el mismo)."""
+    if name == "int8":
+        return quantize_int8(model)
+    if name == "onnx":
+        return OnnxModel(model_root)
+    return model
+
+
+# ======== Compilación del forward (torch.compile / TorchScript) ========
+class TracedModel:
+    """
+    model(**enc_in).logits con grafos TorchScript congelados para secuencias de `max_length`,
+    uno por (modo, filas). El primer forward de cada forma la traza (bajo lock); las demás
+    longitudes van al modelo original.
+    """
+
+    def __init__(self, model: torch.nn.Module, max_length: int):
+        self.model = model
+        self.max_length = max_length
+        self._wrapper = _Exportable(model).eval()
+        self._graphs: Dict[Tuple[bool, int], Any] = {}
+        self._lock = threading.Lock()
+
+    def _graph(self, key: Tuple[bool, int], args: Tuple[torch.Tensor, ...]):
+        graph = self._graphs.get(key)
+        if graph is None:
+            with self._lock:
+                graph = self._graphs.get(key)
+                if graph is None:
+                    with torch.no_grad():
+                        traced = torch.jit.trace(self._wrapper, args, check_trace=False)
+                    graph = self._graphs[key] = torch.jit.freeze(traced.eval())
+                    _log(f"grafo trazado: modo={'texto' if key[0] else 'completo'} filas={key[1]}")
+        return graph
+
+    def __call__(self, **inputs: Optional[torch.Tensor]) -> Any:
+        input_ids = inputs["input_ids"]
+        if input_ids.shape[1] != self.max_length:
+            return self.model(**inputs)
+        pixel_values = inputs.get("pixel_values")
+        args = (input_ids, inputs["bbox"], inputs["attention_mask"])
+        if pixel_values is not None:
+            # el trazado no acepta vistas expandidas como entrada
+            args = args + (pixel_values.contiguous(),)
+        graph = self._graph((pixel_values is None, len(input_ids)), args)
+        return _Output(graph(*args))
+
+
+def compile_model(model, mode: str, max_length: int):
+    """Envuelve el forward según PRED_COMPILE; sin modo (o con onnx) lo devuelve igual."""
+    if not mode:
+        return model
+    if not isinstance(model, torch.nn.Module):
+        _log(f"AVISO: PRED_COMPILE={mode} solo aplica a backends torch; se ignora")
+        return model
+    if mode == "compile":
+        return torch.compile(model, dynamic=False)
+    if mode == "trace":
+        return TracedModel(model, max_length)
+    _log(f"AVISO: PRED_COMPILE={mode} desconocido (compile, trace); se ignora")
+    return model
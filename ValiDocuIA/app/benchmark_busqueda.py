@@ -0,0 +1,156 @@
+# benchmark_busqueda.py — búsqueda semántica: consulta actual (scan completo) vs. top-k con índice ANN
+# -----------------------------------------------------------------------------
+# Compara la consulta de SemanticController::buscarSimilares (calcula el score de todas las
+# filas de semantic_doc_index, filtra y ordena) con semantic.search_documents (ORDER BY
+# embedding <=> q LIMIT k x SEM_ANN_OVERSAMPLE sobre la tabla, que puede usar el índice
+# HNSW/IVFFlat, y luego solo versiones vigentes hasta k, ampliando candidatos si no alcanzan).
+#
+#   python -m app.benchmark_busqueda --consultas consultas.txt --k 10 --repeticiones 3 \
+#       --salida outputs/reporte_busqueda.json
+#
+# Sin --consultas se usan como consultas embeddings ya guardados en la tabla (--muestras).
+# Reporta por consulta: latencia (media/p50/p95) de cada variante, recall@k del top-k frente
+# al scan exacto de la consulta actual restringida a versiones vigentes, cuántas búsquedas
+# top-k quedaron incompletas (tope de candidatos) y el plan (EXPLAIN) de cada variante.
+# Antes de medir: python app/semantic.py --indice hnsw
+# -----------------------------------------------------------------------------
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from app import semantic
+
+SCAN_SQL = f"""
+    SELECT * FROM (
+        SELECT
+            sdi.id, sdi.resumen, sdi.archivo, sdi.document_group_id,
+            dv.document_id, dv.filename AS document_name,
+            g.name AS group_name,
+            dv.due_date AS due_date,
+            dv.normative_gap AS normative_gap,
+            1 - (sdi.embedding <=> %(q)s) as score
+        FROM "{semantic.DOC_TABLE_NAME}" sdi
+        LEFT JOIN document_versions dv ON dv.id = sdi.document_version_id AND dv.is_current = true
+        LEFT JOIN document_groups g ON g.id = sdi.document_group_id
+    ) AS sub
+    WHERE score >= %(min_score)s
+    ORDER BY score DESC
+    LIMIT %(k)s
+"""
+
+# la consulta actual con versiones vigentes (JOIN, no LEFT JOIN): el conjunto que /buscar/ debe devolver
+EXACT_SQL = SCAN_SQL.replace("LEFT JOIN document_versions dv", "JOIN document_versions dv")
+
+
+def _consultas(cur, path: str, muestras: int) -> List[np.ndarray]:
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            textos = [line.strip() for line in f if line.strip()]
+        model = semantic.get_model()
+        if model is None:
+            raise SystemExit("sin modelo de embeddings para vectorizar las consultas")
+        return [semantic.encode_embedding(model, t) for t in textos]
+    cur.execute(f'SELECT "embedding"::text FROM "{semantic.DOC_TABLE_NAME}" '
+                f'WHERE "embedding" IS NOT NULL ORDER BY random() LIMIT %s', (muestras,))
+    return [np.asarray(json.loads(row[0]), dtype=np.float32) for row in cur.fetchall()]
+
+
+def _scan(cur, q: np.ndarray, k: int, min_score: float) -> List[int]:
+    cur.execute(SCAN_SQL, {"q": semantic.PgVector(q), "k": k, "min_score": min_score})
+    return [row[0] for row in cur.fetchall()]
+
+
+def _topk(cur, q: np.ndarray, k: int, min_score: float) -> Dict[str, Any]:
+    return semantic.search_documents_cur(cur, q, k, min_score)
+
+
+def _exacto(cur, q: np.ndarray, k: int, min_score: float) -> List[int]:
+    # referencia del recall: scan exacto, solo versiones vigentes, sin tope de candidatos
+    cur.execute(EXACT_SQL, {"q": semantic.PgVector(q), "k": k, "min_score": min_score})
+    return [row[0] for row in cur.fetchall()]
+
+
+def _plan(cur, sql: str, params: Dict[str, Any]) -> List[str]:
+    cur.execute("EXPLAIN " + sql, params)
+    return [row[0] for row in cur.fetchall()]
+
+
+def _latencias(ms: List[float]) -> Dict[str, float]:
+    arr = np.asarray(ms)
+    return {"media_ms": float(arr.mean()), "p50_ms": float(np.percentile(arr, 50)),
+            "p95_ms": float(np.percentile(arr, 95))}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark de búsqueda semántica (scan vs. índice ANN)")
+    ap.add_argument("--consultas", default="", help="archivo con una consulta de texto por línea")
+    ap.add_argument("--muestras", type=int, default=50, help="embeddings de la tabla a usar si no hay --consultas")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--min-score", type=float, default=0.4)
+    ap.add_argument("--repeticiones", type=int, default=3)
+    ap.add_argument("--salida", default="")
+    args = ap.parse_args()
+
+    conn, cur = semantic.connect_db()
+    if cur is None:
+        raise SystemExit("sin conexión a BD")
+    try:
+        queries = _consultas(cur, args.consultas, args.muestras)
+        if not queries:
+            raise SystemExit("no hay consultas")
+
+        tiempos = {"actual": [], "topk": []}
+        recalls, incompletas = [], 0
+        for q in queries:
+            approx = []
+            for _ in range(max(1, args.repeticiones)):
+                t0 = time.perf_counter()
+                _scan(cur, q, args.k, args.min_score)
+                tiempos["actual"].append((time.perf_counter() - t0) * 1000)
+                t0 = time.perf_counter()
+                busqueda = _topk(cur, q, args.k, args.min_score)
+                tiempos["topk"].append((time.perf_counter() - t0) * 1000)
+                approx = [r["id"] for r in busqueda["resultados"]]
+                conn.rollback()  # descarta los set_config locales de search_documents_cur
+            incompletas += int(busqueda["incompleto"])
+            exact = _exacto(cur, q, args.k, args.min_score)
+            conn.rollback()
+            if exact:
+                recalls.append(len(set(exact) & set(approx)) / len(exact))
+
+        candidates = args.k * max(1, semantic.ANN_OVERSAMPLE)
+        candidates = min(max(args.k, semantic.ANN_MAX_CANDIDATES), candidates)
+        params = {"q": semantic.PgVector(queries[0]), "k": args.k, "candidates": candidates,
+                  "min_score": args.min_score}
+        cur.execute("SELECT set_config('hnsw.ef_search', %s, true), set_config('ivfflat.probes', %s, true)",
+                    (str(min(1000, max(semantic.ANN_EF_SEARCH, candidates))), str(semantic.ANN_PROBES)))
+        reporte = {
+            "consultas": len(queries),
+            "k": args.k,
+            "min_score": args.min_score,
+            "indice": semantic.ann_index_status(cur),
+            "actual": _latencias(tiempos["actual"]),
+            "topk": _latencias(tiempos["topk"]),
+            "recall_at_k": float(np.mean(recalls)) if recalls else None,
+            "topk_incompletas": incompletas,
+            "plan": {"actual": _plan(cur, SCAN_SQL, params),
+                     "topk": _plan(cur, semantic.SEARCH_SQL, params)},
+        }
+        reporte["usa_indice"] = any(semantic.ANN_INDEX_NAME in line for line in reporte["plan"]["topk"])
+        conn.rollback()
+    finally:
+        conn.close()
+
+    print(json.dumps(reporte, ensure_ascii=False, indent=2, default=str))
+    if args.salida:
+        os.makedirs(os.path.dirname(args.salida) or ".", exist_ok=True)
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(reporte, f, ensure_ascii=False, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# consolidation.py — consolidado doc-level (semantic_doc_index) una vez por documento
+# -----------------------------------------------------------------------------
+# Cada página de /procesar/ escribía su fila page-level y además reconstruía json_global,
+# el embedding del resumen y la fila doc-level: un documento de 30 páginas reescribía esa
+# fila 30 veces. Ahora, si el cliente envía el total de páginas (`paginas`), las páginas
+# intermedias solo escriben su fila page-level y la última consolida en la misma petición
+# (consolidate_now): la respuesta sale con semantic_doc_index ya escrito, como esperan los
+# jobs de Laravel antes de createSuggestions. Sin `paginas` se consolida en cada página.
+#
+# Consolidado diferido (solo si el cliente lo pide con consolidacion=diferida): la versión
+# se agenda aquí y un hilo la consolida una vez cuando ya están indexadas todas sus páginas
+# o pasaron SEM_CONSOLIDATE_QUIET_S segundos sin páginas nuevas. Lo pendiente vive en
+# memoria: flush() lo consolida al apagar, pero un kill lo pierde.
+# -----------------------------------------------------------------------------
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from app import semantic
+
+# ======== Config (override por ENV) ========
+QUIET_S = float(os.getenv("SEM_CONSOLIDATE_QUIET_S", "3"))  # silencio por versión antes de consolidar
+
+
+class _Pending:
+    def __init__(self, master_id: int, version_id: int, group_id: Optional[int]):
+        self.master_id = master_id
+        self.version_id = version_id
+        self.group_id = group_id
+        self.archivo: Optional[str] = None
+        self.pages = 0
+        self.deadline = 0.0
+
+
+class ConsolidationScheduler:
+    def __init__(self, quiet_s: float = QUIET_S):
+        self.quiet_s = max(0.0, quiet_s)
+        self._pending: Dict[int, _Pending] = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self.scheduled_pages = 0
+        self.consolidations = 0
+        self.failed = 0
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="consolidation", daemon=True)
+                self._thread.start()
+
+    def schedule(self, master_id: int, version_id: int, group_id: Optional[int],
+                 archivo: Optional[str] = None, total_pages: Optional[int] = None) -> None:
+        """Agenda (o pospone) el consolidado de la versión; inmediato si ya están todas sus páginas."""
+        complete = bool(total_pages) and semantic.document_page_count(master_id, version_id, group_id) >= total_pages
+        self._ensure_started()
+        with self._cond:
+            entry = self._pending.get(version_id)
+            if entry is None:
+                entry = self._pending[version_id] = _Pending(master_id, version_id, group_id)
+            entry.archivo = archivo or entry.archivo
+            entry.pages += 1
+            entry.deadline = time.monotonic() + (0.0 if complete else self.quiet_s)
+            self.scheduled_pages += 1
+            self._cond.notify()
+
+    def _next_due(self) -> Optional[_Pending]:
+        # se llama con el lock tomado; espera hasta que venza algún plazo
+        while True:
+            if not self._pending:
+                self._cond.wait()
+                continue
+            entry = min(self._pending.values(), key=lambda e: e.deadline)
+            timeout = entry.deadline - time.monotonic()
+            if timeout <= 0:
+                return self._pending.pop(entry.version_id)
+            self._cond.wait(timeout)
+
+    def consolidate_now(self, master_id: int, version_id: int, group_id: Optional[int],
+                        archivo: Optional[str] = None) -> Dict[str, Any]:
+        """Consolida en el hilo que llama (y descarta un consolidado diferido pendiente de la versión)."""
+        with self._cond:
+            self._pending.pop(version_id, None)
+        entry = _Pending(master_id, version_id, group_id)
+        entry.archivo = archivo
+        return self._consolidate(entry)
+
+    def _consolidate(self, entry: _Pending) -> Dict[str, Any]:
+        result = semantic.consolidate_document(entry.master_id, entry.version_id, entry.group_id,
+                                               archivo=entry.archivo)
+        with self._cond:
+            self.consolidations += 1
+            if result["status"] != "ok":
+                self.failed += 1
+        return result
+
+    def _run(self):
+        while True:
+            with self._cond:
+                entry = self._next_due()
+            try:
+                self._consolidate(entry)
+            except Exception as e:
+                semantic.logger.error(f"❌ Error consolidando versión {entry.version_id}: {e}")
+                with self._cond:
+                    self.failed += 1
+
+    def flush(self) -> None:
+        """Consolida ya todas las versiones pendientes (en el hilo que llama)."""
+        with self._cond:
+            entries = list(self._pending.values())
+            self._pending.clear()
+        for entry in entries:
+            self._consolidate(entry)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "pendientes": len(self._pending),
+                "paginas_agendadas": self.scheduled_pages,
+                "consolidados": self.consolidations,
+                "fallidos": self.failed,
+                "silencio_s": self.quiet_s,
+            }
+
+
+_SCHEDULER = ConsolidationScheduler()
+
+
+def schedule(master_id: int, version_id: int, group_id: Optional[int],
+             archivo: Optional[str] = None, total_pages: Optional[int] = None) -> None:
+    _SCHEDULER.schedule(master_id, version_id, group_id, archivo, total_pages)
+
+
+def consolidate_now(master_id: int, version_id: int, group_id: Optional[int],
+                    archivo: Optional[str] = None) -> Dict[str, Any]:
+    return _SCHEDULER.consolidate_now(master_id, version_id, group_id, archivo)
+
+
+def flush() -> None:
+    _SCHEDULER.flush()
+
+
+def stats() -> Dict[str, Any]:
+    return _SCHEDULER.stats()
@@ -0,0 +1,107 @@
+# embeddings.py — motor de embeddings residente con micro-batching
+# -----------------------------------------------------------------------------
+# Reemplaza a generar_vector.py (un intérprete + carga de modelo por consulta).
+# Las peticiones concurrentes se acumulan en una cola y un hilo único las codifica
+# juntas en un solo model.encode(), con un plazo corto de espera (EMB_BATCH_WAIT_MS).
+# El modelo es el mismo SentenceTransformer residente que usa semantic.py.
+# -----------------------------------------------------------------------------
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Tuple, Dict, Any
+
+from app import semantic
+
+# ======== Config (override por ENV) ========
+BATCH_MAX_TEXTS = int(os.getenv("EMB_BATCH_MAX", "64"))      # textos máximos por encode()
+BATCH_WAIT_MS   = float(os.getenv("EMB_BATCH_WAIT_MS", "5"))  # espera máxima para llenar un batch
+
+
+class EmbeddingBatcher:
+    def __init__(self, max_texts: int = BATCH_MAX_TEXTS, wait_ms: float = BATCH_WAIT_MS):
+        self.max_texts = max(1, max_texts)
+        self.wait_s = max(0.0, wait_ms) / 1000.0
+        self._queue: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.texts = 0
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        """Encola textos; el Future resuelve a una lista de vectores (List[List[float]])."""
+        fut: Future = Future()
+        if not texts:
+            fut.set_result([])
+            return fut
+        self._ensure_started()
+        self._queue.put((list(texts), fut))
+        return fut
+
+    def _collect(self) -> List[Tuple[List[str], Future]]:
+        batch = [self._queue.get()]
+        n_texts = len(batch[0][0])
+        deadline = time.monotonic() + self.wait_s
+        while n_texts < self.max_texts:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(item)
+            n_texts += len(item[0])
+        # descarta peticiones canceladas (cliente desconectado)
+        return [(t, f) for t, f in batch if f.set_running_or_notify_cancel()]
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                continue
+            texts = [t for ts, _ in batch for t in ts]
+            try:
+                model = semantic.get_model()
+                if model is None:
+                    raise RuntimeError(f"modelo {semantic.MODEL_NAME} no disponible")
+                vectors = model.encode(texts, batch_size=len(texts), convert_to_numpy=True).tolist()
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.texts += len(texts)
+            i = 0
+            for ts, fut in batch:
+                fut.set_result(vectors[i:i + len(ts)])
+                i += len(ts)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pendientes": self._queue.qsize(),
+            "batches": self.batches,
+            "textos": self.texts,
+            "max_textos": self.max_texts,
+            "espera_ms": self.wait_s * 1000.0,
+        }
+
+
+_BATCHER = EmbeddingBatcher()
+
+
+def submit(texts: List[str]) -> Future:
+    return _BATCHER.submit(texts)
+
+
+def stats() -> Dict[str, Any]:
+    return _BATCHER.stats()
@@ -0,0 +1,151 @@
+# evaluar_modo_texto.py — precisión vs. latencia: LayoutLMv3 completo vs. solo texto + layout
+# -----------------------------------------------------------------------------
+# Usa el dataset etiquetado de generador-de-contratos-fake (output/output.json: entradas
+# {"id", "words", "boxes", "labels"} con imágenes en pdf_images/<id>.png). Las palabras y
+# cajas del dataset se usan tal cual (sin OCR), así solo se mide el modelo.
+#
+#   python -m app.evaluar_modo_texto --dataset ../generador-de-contratos-fake/output/output.json \
+#       --imagenes ../generador-de-contratos-fake/pdf_images --modelo outputs/modelo_multiclase \
+#       --salida outputs/reporte_modo_texto.json
+#
+# Reporta por modo: exactitud por palabra, F1 de entidades (spans BIO exactos, global y por
+# etiqueta), latencia por página (media/p50/p95) y el acuerdo palabra a palabra entre modos.
+# Correrlo sobre un dataset de un solo tipo de documento para decidir PRED_TEXT_ONLY por tipo.
+# -----------------------------------------------------------------------------
+import argparse
+import json
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+from PIL import Image
+
+from app import prediccion
+
+MODOS = {"completo": False, "texto": True}
+
+
+def _labels(pred_ids: np.ndarray, conf: np.ndarray, id2label: Dict[int, str], conf_thresh: float) -> List[str]:
+    # misma regla que _group_entities: baja confianza cuenta como "O"
+    return [id2label.get(int(p), "O") if c >= conf_thresh else "O" for p, c in zip(pred_ids, conf)]
+
+
+def _spans(labels: List[str]) -> Set[Tuple[str, int, int]]:
+    spans, cur, start = set(), None, 0
+    for i, lab in enumerate(labels + ["O"]):
+        if cur and not (lab.startswith("I-") and lab[2:] == cur):
+            spans.add((cur, start, i))
+            cur = None
+        if lab.startswith("B-") or (lab.startswith("I-") and cur is None):
+            cur, start = lab[2:], i
+    return spans
+
+
+def _f1(tp: int, n_pred: int, n_gold: int) -> Dict[str, float]:
+    p = tp / n_pred if n_pred else 0.0
+    r = tp / n_gold if n_gold else 0.0
+    return {"precision": round(p, 4), "recall": round(r, 4), "f1": round(2 * p * r / (p + r), 4) if p + r else 0.0}
+
+
+def evaluar(dataset: List[Dict], imagenes: str, model_dir: str, conf_thresh: float,
+            limite: int = 0, repeticiones: int = 1) -> Dict:
+    bundle = prediccion.get_model(model_dir)
+    id2label = {int(k): v for k, v in bundle.id2label.items()}
+    entradas = [e for e in dataset if os.path.isfile(os.path.join(imagenes, e["id"]))
+                or os.path.isfile(os.path.join(imagenes, e["id"] + ".png"))]
+    if limite:
+        entradas = entradas[:limite]
+
+    # calentamiento (primer forward de cada modo)
+    if entradas:
+        e = entradas[0]
+        img = Image.open(_ruta(imagenes, e["id"])).convert("RGB")
+        for text_only in MODOS.values():
+            prediccion._predict_page(bundle, img, e["words"], e["boxes"], text_only=text_only)
+
+    res = {m: {"tiempos": [], "ok": 0, "total": 0, "tp": defaultdict(int), "pred": defaultdict(int),
+               "gold": defaultdict(int)} for m in MODOS}
+    acuerdo, total_palabras = 0, 0
+    for e in entradas:
+        img = Image.open(_ruta(imagenes, e["id"])).convert("RGB")
+        gold = list(e["labels"])
+        gold_spans = _spans(gold)
+        por_modo = {}
+        for modo, text_only in MODOS.items():
+            for _ in range(max(1, repeticiones)):
+                t0 = time.perf_counter()
+                pred_ids, conf = prediccion._predict_page(bundle, img, e["words"], e["boxes"], text_only=text_only)
+                res[modo]["tiempos"].append(time.perf_counter() - t0)
+            pred = _labels(pred_ids, conf, id2label, conf_thresh)
+            por_modo[modo] = pred
+            r = res[modo]
+            r["ok"] += sum(p == g for p, g in zip(pred, gold))
+            r["total"] += len(gold)
+            pred_spans = _spans(pred)
+            for lab, _, _ in pred_spans:
+                r["pred"][lab] += 1
+            for lab, _, _ in gold_spans:
+                r["gold"][lab] += 1
+            for lab, _, _ in pred_spans & gold_spans:
+                r["tp"][lab] += 1
+        acuerdo += sum(a == b for a, b in zip(por_modo["completo"], por_modo["texto"]))
+        total_palabras += len(gold)
+
+    reporte = {"paginas": len(entradas), "palabras": total_palabras, "conf_thresh": conf_thresh,
+               "acuerdo_entre_modos": round(acuerdo / total_palabras, 4) if total_palabras else None,
+               "modos": {}}
+    for modo, r in res.items():
+        t = np.array(r["tiempos"]) * 1000.0
+        etiquetas = sorted(set(r["gold"]) | set(r["pred"]))
+        reporte["modos"][modo] = {
+            "exactitud_palabra": round(r["ok"] / r["total"], 4) if r["total"] else None,
+            "entidades": _f1(sum(r["tp"].values()), sum(r["pred"].values()), sum(r["gold"].values())),
+            "por_etiqueta": {lab: _f1(r["tp"][lab], r["pred"][lab], r["gold"][lab]) for lab in etiquetas},
+            "latencia_ms": {
+                "media": round(float(t.mean()), 1) if len(t) else None,
+                "p50": round(float(np.percentile(t, 50)), 1) if len(t) else None,
+                "p95": round(float(np.percentile(t, 95)), 1) if len(t) else None,
+            },
+        }
+    return reporte
+
+
+def _ruta(imagenes: str, doc_id: str) -> str:
+    ruta = os.path.join(imagenes, doc_id)
+    return ruta if os.path.isfile(ruta) else ruta + ".png"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Reporte precisión/latencia del modo solo texto + layout")
+    ap.add_argument("--dataset", required=True, help="output.json de generador-de-contratos-fake")
+    ap.add_argument("--imagenes", required=True, help="carpeta pdf_images/")
+    ap.add_argument("--modelo", default=prediccion.DEFAULT_MODEL_DIR)
+    ap.add_argument("--conf", type=float, default=prediccion.DEFAULT_CONF_THRESH)
+    ap.add_argument("--limite", type=int, default=0, help="máximo de páginas (0 = todas)")
+    ap.add_argument("--repeticiones", type=int, default=1, help="forwards por página y modo para medir latencia")
+    ap.add_argument("--salida", default=None, help="ruta del reporte JSON")
+    args = ap.parse_args()
+
+    with open(args.dataset, "r", encoding="utf-8") as f:
+        dataset = json.load(f)
+    reporte = evaluar(dataset, args.imagenes, args.modelo, args.conf, args.limite, args.repeticiones)
+
+    print(f"\nPáginas: {reporte['paginas']}  Palabras: {reporte['palabras']}  "
+          f"Acuerdo entre modos: {reporte['acuerdo_entre_modos']}")
+    print(f"{'modo':<10}{'exact.':>9}{'F1 ent.':>9}{'media ms':>10}{'p50 ms':>9}{'p95 ms':>9}")
+    for modo, m in reporte["modos"].items():
+        lat = m["latencia_ms"]
+        print(f"{modo:<10}{m['exactitud_palabra']!s:>9}{m['entidades']['f1']!s:>9}"
+              f"{lat['media']!s:>10}{lat['p50']!s:>9}{lat['p95']!s:>9}")
+
+    if args.salida:
+        os.makedirs(os.path.dirname(args.salida) or ".", exist_ok=True)
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(reporte, f, indent=2, ensure_ascii=False)
+        print(f"\n✅ Reporte: {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# executor.py — pool acotado para trabajo CPU (OCR + LayoutLMv3 + indexación) con control de admisión
+# -----------------------------------------------------------------------------
+# run_in_threadpool encola sin límite: con muchas páginas a la vez la latencia crece sin
+# techo y el proceso acumula imágenes en memoria. Aquí hay PROCESS_WORKERS hilos y a lo
+# sumo PROCESS_QUEUE_MAX trabajos esperando; si no hay lugar, try_submit() devuelve None
+# y el endpoint responde 429 con Retry-After estimado (duración media × cola / workers).
+# DOCUMENTS acota igual los PDFs completos (/procesar_documento/ y sus jobs): cada uno usa
+# PIPELINE_WORKERS hilos, así que a lo sumo PROCESS_DOC_WORKERS x PIPELINE_WORKERS páginas.
+# -----------------------------------------------------------------------------
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+# ======== Config (override por ENV) ========
+PROCESS_WORKERS   = int(os.getenv("PROCESS_WORKERS", "4"))     # páginas ejecutándose a la vez
+PROCESS_QUEUE_MAX = int(os.getenv("PROCESS_QUEUE_MAX", "16"))  # páginas esperando como máximo
+PROCESS_DOC_WORKERS = int(os.getenv("PROCESS_DOC_WORKERS", os.getenv("JOBS_DOC_WORKERS", "1")))  # PDFs completos a la vez
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, workers: int, max_queue: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+        self._lock = threading.Lock()
+        self.pending = 0       # en cola + ejecutándose
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._avg_s: Optional[float] = None  # media móvil de la duración
+
+    def try_submit(self, fn: Callable[..., Any], *args, **kwargs) -> Optional[Future]:
+        """Encola `fn` si hay lugar; None si el pool y la cola están llenos."""
+        if not self._slots.acquire(blocking=False):
+            return None
+        with self._lock:
+            self.pending += 1
+
+        def task():
+            with self._lock:
+                self.running += 1
+            t0 = time.perf_counter()
+            ok = False
+            try:
+                result = fn(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                elapsed = time.perf_counter() - t0
+                with self._lock:
+                    self.running -= 1
+                    self.pending -= 1
+                    if ok:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+                    self._avg_s = elapsed if self._avg_s is None else 0.8 * self._avg_s + 0.2 * elapsed
+                self._slots.release()
+
+        try:
+            return self._pool.submit(task)
+        except Exception:
+            with self._lock:
+                self.pending -= 1
+            self._slots.release()
+            raise
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def full(self) -> bool:
+        with self._lock:
+            return self.pending >= self.workers + self.max_queue
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            return self.pending - self.running
+
+    def retry_after(self) -> int:
+        """Segundos sugeridos al cliente antes de reintentar."""
+        with self._lock:
+            avg = self._avg_s if self._avg_s is not None else 5.0
+            waiting = self.pending - self.running
+        return max(1, math.ceil(avg * (waiting + 1) / self.workers))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "cola_max": self.max_queue,
+                "en_cola": self.pending - self.running,
+                "ejecutando": self.running,
+                "completados": self.completed,
+                "fallidos": self.failed,
+                "rechazados": self.rejected,
+                "duracion_media_s": round(self._avg_s, 3) if self._avg_s is not None else None,
+            }
+
+
+PAGES = BoundedExecutor("procesar", PROCESS_WORKERS, PROCESS_QUEUE_MAX)
+DOCUMENTS = BoundedExecutor("documentos", PROCESS_DOC_WORKERS, 0)
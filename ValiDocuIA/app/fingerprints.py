@@ -0,0 +1,113 @@
+# fingerprints.py — huella de cada página procesada para reutilizarla entre versiones
+# -----------------------------------------------------------------------------
+# Una versión nueva de un documento suele cambiar pocas páginas. Cada página procesada
+# queda registrada por (hash del archivo de imagen, versión del modelo) junto a su JSON de
+# entidades; si una página de otra versión del mismo master tiene la misma huella, se
+# reutiliza ese JSON en vez de repetir OCR + LayoutLMv3 (la fila de semantic_index se
+# escribe igual que para una página nueva).
+# Las imágenes vienen del mismo rasterizador, así que páginas iguales dan bytes iguales.
+# Almacén local SQLite (FINGERPRINT_DB), seguro entre hilos (una conexión por llamada).
+# -----------------------------------------------------------------------------
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import xxhash
+
+FINGERPRINT_DB = os.getenv("FINGERPRINT_DB", "outputs/fingerprints.sqlite3")  # vacío = sin reutilización
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS page_fingerprints (
+    digest        TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    master_id     TEXT NOT NULL,
+    version_id    TEXT NOT NULL,
+    page_id       TEXT NOT NULL,
+    group_id      TEXT,
+    page          INTEGER,
+    json_path     TEXT NOT NULL,
+    image_path    TEXT,
+    created_at    TEXT NOT NULL,
+    PRIMARY KEY (master_id, version_id, page_id, model_version)
+);
+CREATE INDEX IF NOT EXISTS idx_fp_lookup ON page_fingerprints (digest, model_version, master_id);
+"""
+
+_INIT_LOCK = threading.Lock()
+_INITIALIZED = False
+_STATS_LOCK = threading.Lock()  # find_previous corre en hilos de /procesar/ y del pipeline
+hits = 0
+misses = 0
+
+
+def enabled() -> bool:
+    return bool(FINGERPRINT_DB)
+
+
+def _connect() -> sqlite3.Connection:
+    global _INITIALIZED
+    conn = sqlite3.connect(FINGERPRINT_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    if not _INITIALIZED:
+        with _INIT_LOCK:
+            if not _INITIALIZED:
+                os.makedirs(os.path.dirname(FINGERPRINT_DB) or ".", exist_ok=True)
+                conn.executescript(_SCHEMA)
+                _INITIALIZED = True
+    return conn
+
+
+def file_digest(path: str) -> str:
+    h = xxhash.xxh3_128()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def find_previous(digest: str, model_version: str, master_id, version_id) -> Optional[Dict[str, Any]]:
+    """Página más reciente de OTRA versión del mismo master con la misma huella (y JSON aún en disco)."""
+    global hits, misses
+    if not enabled():
+        return None
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            "SELECT * FROM page_fingerprints WHERE digest = ? AND model_version = ? "
+            "AND master_id = ? AND version_id <> ? ORDER BY created_at DESC",
+            (digest, model_version, str(master_id), str(version_id)),
+        ).fetchall()
+    finally:
+        conn.close()
+    for row in rows:
+        if os.path.isfile(row["json_path"]):
+            with _STATS_LOCK:
+                hits += 1
+            return dict(row)
+    with _STATS_LOCK:
+        misses += 1
+    return None
+
+
+def record(digest: str, model_version: str, master_id, version_id, page_id, group_id, page: int,
+           json_path: str, image_path: Optional[str] = None) -> None:
+    if not enabled():
+        return
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO page_fingerprints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (digest, model_version, str(master_id), str(version_id), str(page_id),
+                 str(group_id) if group_id else None, int(page), json_path, image_path,
+                 datetime.now().isoformat()),
+            )
+    finally:
+        conn.close()
+
+
+def stats() -> Dict[str, Any]:
+    with _STATS_LOCK:
+        return {"habilitado": enabled(), "reutilizadas": hits, "nuevas": misses}
@@ -0,0 +1,257 @@
+# jobs.py — trabajos asíncronos de página / documento persistidos en disco
+# -----------------------------------------------------------------------------
+# /jobs/procesar/ y /jobs/procesar_documento/ responden al instante con un job_id; el
+# trabajo queda en un almacén SQLite local (JOBS_DB) y un despachador lo envía al pool
+# acotado (executor) cuando hay lugar. El cliente consulta GET /jobs/{id} o recibe un
+# POST en `callback_url` (solo hosts de JOBS_CALLBACK_HOSTS) al terminar.
+# Al reiniciar el servicio, los trabajos "procesando" vuelven a "pendiente" (la
+# indexación es un upsert por página/versión -ON CONFLICT sobre las claves únicas de
+# semantic_index y semantic_doc_index-, así que repetirla reescribe la misma fila en vez
+# de duplicarla) y los callbacks no entregados se reintentan. Cada entrega hace hasta
+# JOBS_CALLBACK_TRIES intentos con backoff exponencial (JOBS_CALLBACK_BACKOFF_S, x2).
+# Los contadores por estado de /health/ se llevan en memoria (no hay consulta a SQLite).
+# -----------------------------------------------------------------------------
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+
+from app import executor, pipeline
+
+JOBS_DB             = os.getenv("JOBS_DB", "outputs/jobs.sqlite3")
+JOBS_CALLBACK_HOSTS = {h.strip() for h in os.getenv(
+    "JOBS_CALLBACK_HOSTS", "localhost,127.0.0.1,host.docker.internal").split(",") if h.strip()}
+JOBS_CALLBACK_TRIES = int(os.getenv("JOBS_CALLBACK_TRIES", "3"))
+JOBS_CALLBACK_BACKOFF_S = float(os.getenv("JOBS_CALLBACK_BACKOFF_S", "2"))  # espera antes del 2º intento; se duplica
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id              TEXT PRIMARY KEY,
+    tipo            TEXT NOT NULL,   -- pagina | documento
+    estado          TEXT NOT NULL,   -- pendiente | procesando | ok | error
+    params          TEXT NOT NULL,
+    resultado       TEXT,
+    error           TEXT,
+    callback_url    TEXT,
+    callback_estado TEXT,            -- pendiente | entregado | fallido
+    created_at      TEXT NOT NULL,
+    updated_at      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_estado ON jobs (estado, created_at);
+"""
+
+# los documentos comparten el pool acotado de /procesar_documento/
+_EXECUTORS = {"pagina": executor.PAGES, "documento": executor.DOCUMENTS}
+
+_wake = threading.Event()
+_start_lock = threading.Lock()
+_dispatcher: Optional[threading.Thread] = None
+
+# trabajos por estado, en memoria: /health/ no consulta SQLite desde el event loop
+_counts: Dict[str, int] = {}
+_counts_lock = threading.Lock()
+
+
+def _move(old: Optional[str], new: str):
+    with _counts_lock:
+        if old is not None:
+            _counts[old] = max(0, _counts.get(old, 0) - 1)
+        _counts[new] = _counts.get(new, 0) + 1
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(JOBS_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _update(job_id: str, **fields):
+    fields["updated_at"] = _now()
+    cols = ", ".join(f"{k} = ?" for k in fields)
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(f"UPDATE jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+    finally:
+        conn.close()
+
+
+def validate_callback(url: Optional[str]) -> Optional[str]:
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or parsed.hostname not in JOBS_CALLBACK_HOSTS:
+        raise ValueError(f"callback_url no permitido: {url}")
+    return url
+
+
+def submit(tipo: str, params: Dict[str, Any], callback_url: Optional[str] = None) -> str:
+    if tipo not in _EXECUTORS:
+        raise ValueError(f"tipo de trabajo desconocido: {tipo}")
+    start()
+    job_id = uuid.uuid4().hex
+    now = _now()
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO jobs (id, tipo, estado, params, callback_url, callback_estado, created_at, updated_at) "
+                "VALUES (?, ?, 'pendiente', ?, ?, ?, ?, ?)",
+                (job_id, tipo, json.dumps(params), callback_url,
+                 "pendiente" if callback_url else None, now, now),
+            )
+    finally:
+        conn.close()
+    _move(None, "pendiente")
+    _wake.set()
+    return job_id
+
+
+def get(job_id: str) -> Optional[Dict[str, Any]]:
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    job["resultado"] = json.loads(job["resultado"]) if job["resultado"] else None
+    return job
+
+
+def _run_page(p: Dict[str, Any]) -> Dict[str, Any]:
+    return pipeline.process_page(p["image_path"], p["master_id"], p["version_id"], p["page_id"],
+                                 p.get("group_id"), p["page"], p["model_dir"], text_only=p.get("text_only"),
+                                 total_pages=p.get("total_pages"), deferred=p.get("deferred", False))
+
+
+def _run_document(p: Dict[str, Any]) -> Dict[str, Any]:
+    paginas, documento = [], None
+    for line in pipeline.process_document(p["pdf_path"], p["master_id"], p["version_id"], p.get("group_id"),
+                                          p["page_ids"], p["model_dir"]):
+        if line.get("tipo") == "pagina":
+            line.pop("semantic_logs", None)
+            paginas.append(line)
+        elif line.get("tipo") == "documento":
+            documento = line
+    return {"paginas": sorted(paginas, key=lambda l: l["page"]), "documento": documento}
+
+
+_RUNNERS = {"pagina": _run_page, "documento": _run_document}
+
+
+def _execute(job_id: str, tipo: str, params: Dict[str, Any]):
+    try:
+        resultado = _RUNNERS[tipo](params)
+        _update(job_id, estado="ok", resultado=json.dumps(resultado, ensure_ascii=False))
+        _move("procesando", "ok")
+    except Exception as e:
+        _update(job_id, estado="error", error=str(e))
+        _move("procesando", "error")
+    finally:
+        _wake.set()
+    # el callback no ocupa el worker del pool
+    threading.Thread(target=_deliver_callback, args=(job_id,), daemon=True).start()
+
+
+def _deliver_callback(job_id: str):
+    job = get(job_id)
+    if not job or not job["callback_url"] or job["callback_estado"] != "pendiente":
+        return
+    body = {k: job[k] for k in ("id", "tipo", "estado", "resultado", "error")}
+    tries = max(1, JOBS_CALLBACK_TRIES)
+    for attempt in range(tries):
+        if attempt:
+            # backoff exponencial: Laravel caído un momento no agota los intentos de inmediato
+            time.sleep(JOBS_CALLBACK_BACKOFF_S * 2 ** (attempt - 1))
+        try:
+            r = requests.post(job["callback_url"], json=body, timeout=10)
+            if r.ok:
+                _update(job_id, callback_estado="entregado")
+                return
+        except requests.RequestException:
+            pass
+    _update(job_id, callback_estado="fallido")
+
+
+def _dispatch_once() -> bool:
+    """Envía al pool el trabajo pendiente más antiguo cuyo pool tenga lugar."""
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT id, tipo, params FROM jobs WHERE estado = 'pendiente' "
+                            "ORDER BY created_at").fetchall()
+    finally:
+        conn.close()
+    for row in rows:
+        pool = _EXECUTORS[row["tipo"]]
+        if pool.full():
+            continue
+        _update(row["id"], estado="procesando")
+        _move("pendiente", "procesando")
+        fut = pool.try_submit(_execute, row["id"], row["tipo"], json.loads(row["params"]))
+        if fut is None:
+            _update(row["id"], estado="pendiente")
+            _move("procesando", "pendiente")
+            continue
+        return True
+    return False
+
+
+def _dispatch_loop():
+    while True:
+        try:
+            if _dispatch_once():
+                continue
+        except Exception as e:
+            print("[jobs] error en despachador:", e, flush=True)
+        # se despierta con cada trabajo nuevo o terminado; el timeout cubre /procesar/ liberando lugar
+        _wake.wait(timeout=1.0)
+        _wake.clear()
+
+
+def start():
+    """Crea el almacén, recupera trabajos interrumpidos y arranca el despachador (idempotente)."""
+    global _dispatcher
+    if _dispatcher is not None:
+        return
+    with _start_lock:
+        if _dispatcher is not None:
+            return
+        os.makedirs(os.path.dirname(JOBS_DB) or ".", exist_ok=True)
+        conn = _connect()
+        try:
+            with conn:
+                conn.executescript(_SCHEMA)
+                conn.execute("UPDATE jobs SET estado = 'pendiente', updated_at = ? WHERE estado = 'procesando'",
+                             (_now(),))
+            undelivered = [r["id"] for r in conn.execute(
+                "SELECT id FROM jobs WHERE estado IN ('ok', 'error') AND callback_estado = 'pendiente'")]
+            counts = {r[0]: r[1] for r in conn.execute("SELECT estado, COUNT(*) FROM jobs GROUP BY estado")}
+        finally:
+            conn.close()
+        with _counts_lock:
+            _counts.clear()
+            _counts.update(counts)
+        _dispatcher = threading.Thread(target=_dispatch_loop, name="jobs-dispatcher", daemon=True)
+        _dispatcher.start()
+    for job_id in undelivered:
+        threading.Thread(target=_deliver_callback, args=(job_id,), daemon=True).start()
+
+
+def stats() -> Dict[str, Any]:
+    with _counts_lock:
+        counts = {k: v for k, v in _counts.items() if v}
+    return {"trabajos": counts, "documentos": executor.DOCUMENTS.stats()}
@@ -1,19 +1,105 @@
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-import subprocess
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import asyncio
+import queue
+import threading
 import json
-from app import prediccion
+from app import prediccion, semantic, embeddings, pipeline, rasterizer, transport, ocr, fingerprints, executor, jobs, topology, consolidation
 from PIL import Image
 import io
 import os
 
-app = FastAPI()
-
 MODEL_DIR = os.getenv("MODEL_DIR", "/app/modelo_multiclase")
+PRELOAD_MODEL = os.getenv("PRELOAD_MODEL", "1") == "1"
 
 def _assert_model_dir(path: str):
     if not os.path.isdir(path):
         raise FileNotFoundError(f"Modelo no encontrado en: {path}")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # presupuesto de hilos por etapa antes del primer forward / OCR / rasterizado
+    topology.configure(
+        ocr_workers=ocr.OCR_WORKERS,
+        poppler_threads=rasterizer.POPPLER_THREADS,
+        forward_workers=1 if prediccion.USE_SCHEDULER else executor.PROCESS_WORKERS + pipeline.PIPELINE_WORKERS,
+    )
+    # Carga el modelo en segundo plano: el servidor arranca y /health/ informa cuándo está listo
+    if PRELOAD_MODEL and os.path.isdir(MODEL_DIR):
+        threading.Thread(target=prediccion.preload_model, args=(MODEL_DIR,), daemon=True).start()
+    if PRELOAD_MODEL:
+        threading.Thread(target=semantic.get_model, daemon=True).start()
+    # retoma los trabajos asíncronos que quedaron pendientes antes de reiniciar
+    jobs.start()
+    yield
+    # los consolidados doc-level que seguían esperando su silencio se hacen ahora
+    consolidation.flush()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.get("/health/")
+async def health():
+    ready = prediccion.is_model_ready(MODEL_DIR)
+    body = {
+        "ready": ready,
+        "model_dir": MODEL_DIR,
+        "modelos": prediccion.registry_status(),
+        "backend": prediccion.backend_status(),
+        "scheduler": prediccion.scheduler_status(),
+        "embeddings": embeddings.stats(),
+        "ocr": ocr.stats(),
+        "cpu": topology.stats(),
+        "reutilizacion": fingerprints.stats(),
+        "procesar": executor.PAGES.stats(),
+        "jobs": jobs.stats(),
+        "consolidacion": consolidation.stats(),
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+def _busy_response(pool: "executor.BoundedExecutor") -> HTTPException:
+    pool.reject()
+    return HTTPException(
+        status_code=429,
+        detail={"error": "servicio ocupado", "en_cola": pool.queue_depth()},
+        headers={"Retry-After": str(pool.retry_after()), "X-Queue-Depth": str(pool.queue_depth())},
+    )
+
+@app.get("/cola/")
+async def cola():
+    # profundidad de cola para que los jobs de Laravel decidan cuándo enviar
+    return executor.PAGES.stats()
+
+async def _save_upload(file: UploadFile, nombre: str) -> str:
+    ruta = os.path.join("outputs", nombre)
+    contents = await file.read()
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta, "wb") as f:
+        f.write(contents)
+    return ruta
+
+def _pdf_upload_name(master_id: str, version_id: str, file: UploadFile) -> str:
+    return f"{master_id}_{version_id}_{os.path.basename(file.filename or 'documento.pdf')}"
+
+def _parse_modo(modo: str):
+    """modo=texto: LayoutLMv3 sin rama visual; modo=completo: con imagen; vacío: PRED_TEXT_ONLY."""
+    if not modo:
+        return None
+    if modo not in ("texto", "completo"):
+        raise HTTPException(status_code=400, detail=f"modo inválido: {modo} (texto | completo)")
+    return modo == "texto"
+
+def _parse_consolidacion(consolidacion: str) -> bool:
+    """consolidacion=diferida: semantic_doc_index se escribe después de responder (opt-in)."""
+    if not consolidacion or consolidacion == "inmediata":
+        return False
+    if consolidacion != "diferida":
+        raise HTTPException(status_code=400, detail=f"consolidacion inválida: {consolidacion} (inmediata | diferida)")
+    return True
+
 @app.post("/procesar/")
 async def procesar_documento(
     file: UploadFile = File(...),
@@ -21,40 +107,33 @@ async def procesar_documento(
     version_id: str = Form(...),     # <-- ID de la versión del documento
     page_id: str = Form(...),        # <-- ID de document_pages
     group_id: str = Form(None),      # <-- ID del grupo (opcional para documentos sueltos)
-    page: int = Form(...)            # <-- número de página (1,2,3,...)
+    page: int = Form(...),           # <-- número de página (1,2,3,...)
+    modo: str = Form(None),          # <-- "texto" | "completo" (por tipo de documento)
+    paginas: int = Form(None),       # <-- total de páginas (opcional): consolida solo en la última
+    consolidacion: str = Form(None)  # <-- "inmediata" (defecto) | "diferida" (después de responder)
 ):
+    text_only = _parse_modo(modo)
+    deferred = _parse_consolidacion(consolidacion)
+    if executor.PAGES.full():
+        raise _busy_response(executor.PAGES)
     try:
-        suffix = f"_p{page:04d}"  # 0001, 0002, ...
-        # Para documentos sueltos, usar "loose" en vez de group_id
-        group_part = group_id if group_id else "loose"
-        base   = f"{master_id}_{version_id}_{page_id}_{group_part}{suffix}"
+        base = pipeline.page_base(master_id, version_id, page_id, group_id, page)
 
         # 1) Guardar imagen temporal
-        nombre_img = f"{base}.png"
-        ruta_img   = os.path.join("outputs", nombre_img)
-        contents   = await file.read()
-        os.makedirs(os.path.dirname(ruta_img), exist_ok=True)
-        with open(ruta_img, "wb") as f:
-            f.write(contents)
-
-        # 2) Ejecutar predicción
-        _assert_model_dir(MODEL_DIR)
-        prediccion.OUTPUT_IMG = os.path.join("outputs", f"resultado_{base}.png")
-        json_output = os.path.join("outputs", f"documento_{base}.json")
-
-        prediccion.run_prediction(
-            image_path=ruta_img,
-            model_path=MODEL_DIR,
-            output_img_path=prediccion.OUTPUT_IMG,
-            output_json_path=json_output
-        )
+        ruta_img = await _save_upload(file, f"{base}.png")
 
-        # 3) Agregación semántica
-        # semantic.py procesará el JSON y lo insertará en semantic_index
-        completed = subprocess.run(
-            ["python3", "app/semantic.py", json_output],
-            check=False, capture_output=True, text=True
+        # 2) Predicción + 3) agregación semántica (en proceso: modelo y pool de BD residentes)
+        # en el pool acotado, fuera del event loop: las páginas concurrentes comparten
+        # batches en el scheduler y /vector/ sigue respondiendo
+        _assert_model_dir(MODEL_DIR)
+        fut = executor.PAGES.try_submit(
+            pipeline.process_page,
+            ruta_img, master_id, version_id, page_id, group_id, page, MODEL_DIR, text_only=text_only,
+            total_pages=paginas, deferred=deferred
         )
+        if fut is None:
+            raise _busy_response(executor.PAGES)
+        result = await asyncio.wrap_future(fut)
 
         body = {
             "mensaje": "✅ Página procesada",
@@ -63,37 +142,231 @@ async def procesar_documento(
             "page_id": page_id,
             "group_id": group_id,
             "page": page,
-            "json": json_output,
-            "imagen_procesada": prediccion.OUTPUT_IMG,
-            "semantic_status": "ok" if completed.returncode == 0 else "error",
-            "semantic_logs": (completed.stderr or completed.stdout or "").strip()[:1000]
+            **result
         }
-        return body
+        return JSONResponse(body, headers={"X-Queue-Depth": str(executor.PAGES.queue_depth())})
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error en /procesar: {e}")
 
 
+def _parse_page_ids(raw: str) -> List[str]:
+    """Acepta JSON ("[11, 12]") o separado por comas ("11,12"), en orden de página."""
+    raw = (raw or "").strip()
+    if raw.startswith("["):
+        return [str(x) for x in json.loads(raw)]
+    return [x.strip() for x in raw.split(",") if x.strip()]
+
+@app.post("/procesar_documento/")
+async def procesar_documento_completo(
+    file: UploadFile = File(...),
+    master_id: str = Form(...),      # <-- ID del documento master
+    version_id: str = Form(...),     # <-- ID de la versión del documento
+    page_ids: str = Form(...),       # <-- IDs de document_pages en orden de página
+    group_id: str = Form(None),      # <-- ID del grupo (opcional para documentos sueltos)
+):
+    """
+    PDF completo en una sola llamada: rasteriza, predice e indexa página a página y
+    responde NDJSON (una línea por página apenas termina + una línea final "documento").
+    """
+    if executor.DOCUMENTS.full():
+        raise _busy_response(executor.DOCUMENTS)
+    try:
+        ids = _parse_page_ids(page_ids)
+        _assert_model_dir(MODEL_DIR)
+        pdf_path = await _save_upload(file, _pdf_upload_name(master_id, version_id, file))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error en /procesar_documento: {e}")
+
+    # el documento corre en el pool acotado de documentos; las líneas llegan por una cola
+    out: "queue.Queue" = queue.Queue(maxsize=max(1, pipeline.PIPELINE_MAX_INFLIGHT))
+    abandoned = threading.Event()
+
+    def put(item) -> bool:
+        # si el cliente se desconecta, el worker deja de producir y libera su lugar
+        while not abandoned.is_set():
+            try:
+                out.put(item, timeout=1.0)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for line in pipeline.process_document(pdf_path, master_id, version_id, group_id, ids, MODEL_DIR):
+                if not put(line):
+                    return
+        except Exception as e:
+            put({"tipo": "error", "error": str(e)})
+        finally:
+            put(None)
+
+    fut = executor.DOCUMENTS.try_submit(produce)
+    if fut is None:
+        raise _busy_response(executor.DOCUMENTS)
+
+    def lines():
+        try:
+            while True:
+                line = out.get()
+                if line is None:
+                    break
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+        finally:
+            abandoned.set()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+# ======== Trabajos asíncronos (job_id + consulta o callback) ========
+def _job_accepted(job_id: str) -> JSONResponse:
+    return JSONResponse({"job_id": job_id, "estado": "pendiente", "status_url": f"/jobs/{job_id}"},
+                        status_code=202)
+
+@app.post("/jobs/procesar/")
+async def job_procesar(
+    file: UploadFile = File(...),
+    master_id: str = Form(...),
+    version_id: str = Form(...),
+    page_id: str = Form(...),
+    group_id: str = Form(None),
+    page: int = Form(...),
+    modo: str = Form(None),
+    paginas: int = Form(None),       # <-- total de páginas (opcional), como en /procesar/
+    consolidacion: str = Form(None), # <-- "inmediata" | "diferida", como en /procesar/
+    callback_url: str = Form(None),  # <-- POST con el resultado al terminar (host local)
+):
+    """Como /procesar/, pero responde al instante con un job_id."""
+    text_only = _parse_modo(modo)
+    deferred = _parse_consolidacion(consolidacion)
+    try:
+        callback = jobs.validate_callback(callback_url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        _assert_model_dir(MODEL_DIR)
+        base = pipeline.page_base(master_id, version_id, page_id, group_id, page)
+        ruta_img = await _save_upload(file, f"{base}.png")
+        job_id = jobs.submit("pagina", {
+            "image_path": ruta_img, "master_id": master_id, "version_id": version_id,
+            "page_id": page_id, "group_id": group_id, "page": page, "model_dir": MODEL_DIR,
+            "text_only": text_only, "total_pages": paginas, "deferred": deferred,
+        }, callback)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error en /jobs/procesar: {e}")
+    return _job_accepted(job_id)
+
+@app.post("/jobs/procesar_documento/")
+async def job_procesar_documento(
+    file: UploadFile = File(...),
+    master_id: str = Form(...),
+    version_id: str = Form(...),
+    page_ids: str = Form(...),
+    group_id: str = Form(None),
+    callback_url: str = Form(None),
+):
+    """Como /procesar_documento/, pero responde al instante con un job_id."""
+    try:
+        callback = jobs.validate_callback(callback_url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        ids = _parse_page_ids(page_ids)
+        _assert_model_dir(MODEL_DIR)
+        pdf_path = await _save_upload(file, _pdf_upload_name(master_id, version_id, file))
+        job_id = jobs.submit("documento", {
+            "pdf_path": pdf_path, "master_id": master_id, "version_id": version_id,
+            "group_id": group_id, "page_ids": ids, "model_dir": MODEL_DIR,
+        }, callback)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error en /jobs/procesar_documento: {e}")
+    return _job_accepted(job_id)
+
+@app.get("/jobs/{job_id}")
+async def job_estado(job_id: str):
+    job = await run_in_threadpool(jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job no encontrado")
+    job.pop("params", None)
+    return job
+
+
 from pydantic import BaseModel
 
 class TextoRequest(BaseModel):
     texto: str
 
+class TextosRequest(BaseModel):
+    textos: List[str]
+
+class BusquedaRequest(BaseModel):
+    texto: Optional[str] = None
+    embedding: Optional[List[float]] = None
+    k: int = 10
+    min_score: float = 0.4
+
 @app.post("/vector/")
 async def generar_vector(data: TextoRequest):
-    from subprocess import check_output, CalledProcessError
-    import json
+    # Modelo residente + micro-batching con otras consultas concurrentes
+    try:
+        vectors = await asyncio.wrap_future(embeddings.submit([data.texto.strip()]))
+        return {"embedding": vectors[0]}
+    except Exception as e:
+        return {"error": f"vectorizado falló: {e}"}
 
+@app.post("/vectors/")
+async def generar_vectores(data: TextosRequest):
     try:
-        result = check_output(["python3", "app/generar_vector.py", data.texto])
-        return {"embedding": json.loads(result)}
-    except CalledProcessError as cpe:
-        return {"error": f"vectorizado falló: {cpe}"}
+        vectors = await asyncio.wrap_future(embeddings.submit([t.strip() for t in data.textos]))
+        return {"embeddings": vectors}
+    except Exception as e:
+        return {"error": f"vectorizado falló: {e}"}
+
+@app.post("/buscar/")
+async def buscar(data: BusquedaRequest):
+    # Top-k por similitud coseno sobre semantic_doc_index (usa el índice ANN si existe)
+    if data.embedding is None and not (data.texto or "").strip():
+        raise HTTPException(status_code=422, detail="se requiere texto o embedding")
+    try:
+        embedding = data.embedding
+        if embedding is None:
+            embedding = (await asyncio.wrap_future(embeddings.submit([data.texto.strip()])))[0]
+        busqueda = await run_in_threadpool(semantic.search_documents, embedding,
+                                           max(1, min(data.k, 100)), data.min_score)
+        # incompleto: menos de k resultados porque se llegó al tope de candidatos del índice
+        return jsonable_encoder(busqueda)
+    except Exception as e:
+        return {"error": f"búsqueda falló: {e}"}
 
 import base64
 
+def _stream_pdf_pages(pdf_path: str, nombre_archivo: str):
+    """NDJSON: una línea por página en cuanto se rasteriza (memoria acotada a la ventana)."""
+    try:
+        total = 0
+        for n, page in rasterizer.iter_pages(pdf_path):
+            filename = f"{os.path.splitext(nombre_archivo)[0]}_p{n}.png"
+            b64img = base64.b64encode(rasterizer.png_bytes(page)).decode()
+            del page
+            total += 1
+            yield json.dumps({"page": n, "filename": filename, "content_base64": b64img}) + "\n"
+        yield json.dumps({"total": total}) + "\n"
+    except Exception as e:
+        yield json.dumps({"error": str(e)}) + "\n"
+
+def _iter_png_pages(pdf_path: str, nombre_archivo: str):
+    for n, page in rasterizer.iter_pages(pdf_path):
+        yield f"{os.path.splitext(nombre_archivo)[0]}_p{n}.png", rasterizer.png_bytes(page)
+
 @app.post("/pdf_to_images/")
-async def convertir_pdf(file: UploadFile = File(...)):
+async def convertir_pdf(file: UploadFile = File(...), stream: bool = False, formato: str = "json"):
+    """
+    formato=json (default): {"images": [{filename, content_base64}]}; con stream=true, NDJSON.
+    formato=zip | multipart: PNG binarios (sin base64) escritos a medida que se rasterizan.
+    """
     nombre_archivo = file.filename
     pdf_path = os.path.join("outputs", nombre_archivo)
 
@@ -101,6 +374,21 @@ async def convertir_pdf(file: UploadFile = File(...)):
     with open(pdf_path, "wb") as f:
         f.write(await file.read())
 
+    if formato == "zip":
+        return StreamingResponse(
+            transport.zip_stream(_iter_png_pages(pdf_path, nombre_archivo)),
+            media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="{os.path.splitext(nombre_archivo)[0]}.zip"'}
+        )
+    if formato == "multipart":
+        boundary = transport.multipart_boundary()
+        return StreamingResponse(
+            transport.multipart_stream(_iter_png_pages(pdf_path, nombre_archivo), boundary),
+            media_type=f"multipart/mixed; boundary={boundary}"
+        )
+    if stream:
+        return StreamingResponse(_stream_pdf_pages(pdf_path, nombre_archivo), media_type="application/x-ndjson")
+
     try:
         from pdf2image import convert_from_path
 
@@ -0,0 +1,314 @@
+# ocr.py — motor OCR (Tesseract) en un pool de procesos compartido por todas las peticiones
+# -----------------------------------------------------------------------------
+# pytesseract lanza un proceso tesseract por imagen y espera; dentro de la petición eso
+# ocupa un solo núcleo. Aquí las páginas (de cualquier petición) se envían a un pool de
+# OCR_WORKERS procesos. Opcionalmente, las páginas altas se cortan en OCR_BANDS franjas
+# horizontales solapadas que se reconocen en paralelo y se vuelven a unir:
+#   - cada franja tiene un "núcleo" sin solape; una palabra se queda solo en la franja
+#     cuyo núcleo contiene su centro vertical (así no se duplican las del solape);
+#   - las coordenadas se devuelven en píxeles de la página completa, así la
+#     normalización 0..1000 de prediccion._ocr_words_boxes no cambia.
+# OCR_WORKERS=0 desactiva el pool (tesseract en el hilo que llama, como antes).
+# Los hilos OpenMP de cada tesseract y su afinidad salen de app.topology (initializer del pool;
+# sin pool, OMP_THREAD_LIMIT se fija en el proceso antes del primer tesseract).
+#
+# Caché en disco (OCR_CACHE_DIR): el resultado de una página se guarda con clave
+# xxh3-128(píxeles + lang + config + franjas/solape efectivos). Re-subidas, versiones nuevas con páginas sin cambios
+# y reintentos no vuelven a pasar por tesseract. Tamaño acotado (OCR_CACHE_MAX_MB) con
+# desalojo LRU; el orden de uso se persiste en el mtime de cada archivo.
+# -----------------------------------------------------------------------------
+import os
+import json
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import List, Tuple, Dict, Any, Optional
+
+from PIL import Image
+import pytesseract
+import xxhash
+
+from app import topology
+
+# ======== Config (override por ENV) ========
+OCR_WORKERS         = int(os.getenv("OCR_WORKERS", str(min(4, os.cpu_count() or 1))))
+OCR_BANDS           = int(os.getenv("OCR_BANDS", "1"))               # franjas por página alta (1 = sin cortar)
+OCR_BAND_MIN_HEIGHT = int(os.getenv("OCR_BAND_MIN_HEIGHT", "2000"))  # px: solo se cortan páginas más altas
+OCR_BAND_OVERLAP    = int(os.getenv("OCR_BAND_OVERLAP", "80"))       # px de solape entre franjas
+OCR_CACHE_DIR       = os.getenv("OCR_CACHE_DIR", "outputs/ocr_cache")  # vacío = sin caché
+OCR_CACHE_MAX_MB    = float(os.getenv("OCR_CACHE_MAX_MB", "512"))
+
+# (texto, left, top, width, height) en píxeles de la página completa
+Token = Tuple[str, int, int, int, int]
+
+
+class _TesseractMissing(RuntimeError):
+    """TesseractNotFoundError no se puede re-crear al volver del proceso hijo."""
+
+
+def _tesseract_tokens(img: Image.Image, lang: str, config: str, offset_y: int = 0) -> List[Token]:
+    try:
+        data = pytesseract.image_to_data(img, lang=lang, config=config, output_type=pytesseract.Output.DICT)
+    except pytesseract.TesseractNotFoundError as e:
+        raise _TesseractMissing(str(e))
+    tokens: List[Token] = []
+    for i in range(len(data.get("text", []))):
+        w = (data["text"][i] or "").strip()
+        if not w:
+            continue
+        tokens.append((
+            w,
+            int(data["left"][i] or 0),
+            int(data["top"][i] or 0) + offset_y,
+            int(data["width"][i] or 0),
+            int(data["height"][i] or 0),
+        ))
+    return tokens
+
+
+def _bands(height: int, n_bands: int, overlap: int) -> List[Tuple[int, int, int, int]]:
+    """(top, bottom, core_top, core_bottom) de cada franja; los núcleos cubren [0, height)."""
+    step = -(-height // n_bands)
+    out = []
+    for k in range(n_bands):
+        core_top = k * step
+        core_bottom = min(height, core_top + step)
+        if core_top >= core_bottom:
+            break
+        out.append((max(0, core_top - overlap), min(height, core_bottom + overlap), core_top, core_bottom))
+    return out
+
+
+def image_digest(img: Image.Image) -> str:
+    """Hash de contenido de la imagen decodificada (independiente del formato/metadata del archivo)."""
+    h = xxhash.xxh3_128()
+    h.update(f"{img.mode}:{img.size[0]}x{img.size[1]}:".encode())
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+
+class OcrCache:
+    def __init__(self, directory: str = OCR_CACHE_DIR, max_mb: float = OCR_CACHE_MAX_MB):
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # key -> bytes, de menos a más reciente
+        self._total = 0
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory) and self.max_bytes > 0
+
+    @staticmethod
+    def key(digest: str, lang: str, config: str, bands: int = 1, overlap: int = 0) -> str:
+        # el corte en franjas cambia los tokens: forma parte de la clave
+        return xxhash.xxh3_128(f"{digest}\0{lang}\0{config}\0{bands}\0{overlap}".encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load_index(self):
+        # se llama con el lock tomado
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            found.append((st.st_mtime, name[:-5], st.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total += size
+        self._loaded = True
+        self._evict()
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def get(self, key: str) -> Optional[List[Token]]:
+        with self._lock:
+            self._load_index()
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        try:
+            path = self._path(key)
+            with open(path, "r", encoding="utf-8") as f:
+                tokens = [tuple(t) for t in json.load(f)]
+            os.utime(path)  # LRU persistente
+        except (OSError, ValueError):
+            with self._lock:
+                self._total -= self._entries.pop(key, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return tokens
+
+    def put(self, key: str, tokens: List[Token]):
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with self._lock:
+                self._load_index()
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(tokens, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, path)
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            self._total += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "habilitado": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else None,
+                "entradas": len(self._entries),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "desalojos": self.evictions,
+            }
+
+
+class OcrEngine:
+    def __init__(self, workers: int = OCR_WORKERS, bands: int = OCR_BANDS,
+                 band_min_height: int = OCR_BAND_MIN_HEIGHT, band_overlap: int = OCR_BAND_OVERLAP,
+                 cache: Optional[OcrCache] = None):
+        self.cache = cache
+        self.workers = max(0, workers)
+        self.bands = max(1, bands)
+        self.band_min_height = band_min_height
+        self.band_overlap = max(0, band_overlap)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._in_process_ready = False
+        self._stats_lock = threading.Lock()  # contadores actualizados desde muchas peticiones
+        self.pages = 0
+        self.banded_pages = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is not None:
+            return self._pool
+        with self._lock:
+            if self._pool is None:
+                # spawn: no heredamos los hilos de torch del proceso principal
+                layout = topology.current()
+                cores = layout.ocr_cores if layout is not None and layout.pin else []
+                threads = layout.ocr_threads if layout is not None else topology.CPU_OCR_THREADS
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=topology.ocr_worker_init,
+                                                 initargs=(cores, threads))
+        return self._pool
+
+    def _in_process_tokens(self, img: Image.Image, lang: str, config: str) -> List[Token]:
+        # sin pool: los tesseract heredan el entorno de este proceso. Se fija aquí (y no al
+        # importar) para no limitar el OpenMP de torch, que ya leyó su entorno al cargarse.
+        if not self._in_process_ready:
+            layout = topology.current()
+            threads = layout.ocr_threads if layout is not None else topology.CPU_OCR_THREADS
+            topology.in_process_ocr_init(threads)
+            self._in_process_ready = True
+        return _tesseract_tokens(img, lang, config)
+
+    def _submit(self, img: Image.Image, lang: str, config: str, offset_y: int = 0) -> Future:
+        try:
+            return self._get_pool().submit(_tesseract_tokens, img, lang, config, offset_y)
+        except RuntimeError:
+            # pool roto (p.ej. un worker murió): se cierra y se recrea una vez
+            with self._lock:
+                broken, self._pool = self._pool, None
+            if broken is not None:
+                broken.shutdown(wait=False)
+            return self._get_pool().submit(_tesseract_tokens, img, lang, config, offset_y)
+
+    def words(self, img: Image.Image, lang: str, config: str) -> List[Token]:
+        """Tokens de la página en orden de lectura; una página ya vista sale de la caché."""
+        if self.cache is None or not self.cache.enabled:
+            return self._recognize(img, lang, config)
+        bands, overlap = self._band_config(img)
+        key = OcrCache.key(image_digest(img), lang, config, bands, overlap)
+        tokens = self.cache.get(key)
+        if tokens is None:
+            tokens = self._recognize(img, lang, config)
+            self.cache.put(key, tokens)
+        return tokens
+
+    def _band_config(self, img: Image.Image) -> Tuple[int, int]:
+        """(franjas, solape) que se usarán realmente para esta imagen; (1, 0) si no se corta."""
+        if self.workers == 0 or self.bands == 1 or img.size[1] < self.band_min_height:
+            return 1, 0
+        return self.bands, self.band_overlap
+
+    def _recognize(self, img: Image.Image, lang: str, config: str) -> List[Token]:
+        """Tesseract (franja a franja, de arriba abajo, si la página se corta)."""
+        with self._stats_lock:
+            self.pages += 1
+        try:
+            if self.workers == 0:
+                return self._in_process_tokens(img, lang, config)
+            W, H = img.size
+            if self._band_config(img)[0] == 1:
+                return self._submit(img, lang, config).result()
+
+            with self._stats_lock:
+                self.banded_pages += 1
+            bands = _bands(H, self.bands, self.band_overlap)
+            futures = [self._submit(img.crop((0, top, W, bottom)), lang, config, top)
+                       for top, bottom, _, _ in bands]
+            tokens: List[Token] = []
+            for (_, _, core_top, core_bottom), fut in zip(bands, futures):
+                for tok in fut.result():
+                    center_y = tok[2] + tok[4] / 2.0
+                    if core_top <= center_y < core_bottom:
+                        tokens.append(tok)
+            return tokens
+        except _TesseractMissing:
+            raise pytesseract.TesseractNotFoundError()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            pages, banded = self.pages, self.banded_pages
+        return {
+            "workers": self.workers,
+            "franjas": self.bands,
+            "paginas": pages,
+            "paginas_en_franjas": banded,
+            "cache": self.cache.stats() if self.cache is not None else None,
+        }
+
+
+_ENGINE = OcrEngine(cache=OcrCache())
+
+
+def words(img: Image.Image, lang: str, config: str) -> List[Token]:
+    return _ENGINE.words(img, lang, config)
+
+
+def stats() -> Dict[str, Any]:
+    return _ENGINE.stats()
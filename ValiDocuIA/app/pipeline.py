@@ -0,0 +1,166 @@
+# pipeline.py — procesamiento de una página y de un PDF completo (OCR + LayoutLMv3 + índice semántico)
+# -----------------------------------------------------------------------------
+# process_page():     imagen ya guardada -> run_prediction -> semantic.index_page
+#                     (si la misma imagen ya se procesó en otra versión del documento con
+#                     el mismo modelo, se reutiliza su JSON: no hay OCR ni LayoutLMv3);
+#                     la fila page-level se escribe al momento; el consolidado doc-level se
+#                     hace en la misma llamada (en la última página si se conoce el total,
+#                     o en cada página si no) o, si se pide, diferido en app.consolidation
+# process_document(): PDF -> rasteriza página a página y, mientras tanto, las páginas ya
+#                     rasterizadas se predicen/indexan en paralelo. Entrega un dict por
+#                     página apenas termina y consolida semantic_doc_index una sola vez al final.
+# -----------------------------------------------------------------------------
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, Iterator, List, Optional
+
+from PIL import Image
+
+from app import prediccion, semantic, rasterizer, fingerprints, consolidation
+
+OUTPUT_DIR = "outputs"
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "2"))         # páginas procesándose a la vez
+PIPELINE_MAX_INFLIGHT = int(os.getenv("PIPELINE_MAX_INFLIGHT", "4"))  # páginas rasterizadas en memoria
+
+
+def page_base(master_id, version_id, page_id, group_id, page: int) -> str:
+    suffix = f"_p{int(page):04d}"  # 0001, 0002, ...
+    # Para documentos sueltos, usar "loose" en vez de group_id
+    group_part = group_id if group_id else "loose"
+    return f"{master_id}_{version_id}_{page_id}_{group_part}{suffix}"
+
+
+def process_page(image_path: str, master_id, version_id, page_id, group_id, page: int,
+                 model_dir: str, consolidate: bool = True, text_only: Optional[bool] = None,
+                 total_pages: Optional[int] = None, deferred: bool = False) -> Dict[str, Any]:
+    if text_only is None:
+        text_only = prediccion.DEFAULT_TEXT_ONLY
+    base = page_base(master_id, version_id, page_id, group_id, page)
+    output_img = os.path.join(OUTPUT_DIR, f"resultado_{base}.png")
+    json_output = os.path.join(OUTPUT_DIR, f"documento_{base}.json")
+
+    digest, mver, previous = None, None, None
+    if fingerprints.enabled():
+        digest = fingerprints.file_digest(image_path)
+        mver = prediccion.model_version(model_dir, text_only)
+        previous = fingerprints.find_previous(digest, mver, master_id, version_id)
+
+    if previous:
+        # página sin cambios respecto a otra versión: no hay OCR ni LayoutLMv3
+        shutil.copyfile(previous["json_path"], json_output)
+        if previous.get("image_path") and os.path.isfile(previous["image_path"]):
+            shutil.copyfile(previous["image_path"], output_img)
+    else:
+        prediccion.run_prediction(
+            image_path=image_path,
+            model_path=model_dir,
+            output_img_path=output_img,
+            output_json_path=json_output,
+            text_only=text_only
+        )
+    if digest:
+        fingerprints.record(digest, mver, master_id, version_id, page_id, group_id, page,
+                            json_output, output_img)
+
+    # semantic.py procesará el JSON y lo insertará en semantic_index
+    semantic_result = semantic.index_page(json_output, consolidate=False)
+    consolidated = None
+    if consolidate:
+        group_int = int(group_id) if group_id and str(group_id).isdigit() else None
+        archivo = os.path.basename(json_output)
+        if deferred:
+            # opt-in: una sola vez por versión, al completar el documento o tras un silencio
+            consolidation.schedule(int(master_id), int(version_id), group_int,
+                                   archivo=archivo, total_pages=total_pages)
+            consolidated = "agendado"
+        elif total_pages and int(page) < int(total_pages) and \
+                semantic.document_page_count(int(master_id), int(version_id), group_int) < int(total_pages):
+            # página intermedia: el consolidado lo hace la última
+            consolidated = "pendiente"
+        else:
+            # última página (o total desconocido): se responde con la fila doc-level ya escrita
+            consolidated = consolidation.consolidate_now(int(master_id), int(version_id), group_int,
+                                                         archivo=archivo)["status"]
+    return {
+        "json": json_output,
+        "imagen_procesada": output_img,
+        "reutilizada_de": previous["page_id"] if previous else None,
+        "semantic_status": semantic_result["status"],
+        "semantic_logs": semantic_result["logs"].strip()[:1000],
+        "consolidado": consolidated,
+    }
+
+
+def _process_pdf_page(image: Image.Image, page: int, page_id: Optional[str],
+                      master_id, version_id, group_id, model_dir: str) -> Dict[str, Any]:
+    line: Dict[str, Any] = {"tipo": "pagina", "page": page, "page_id": page_id}
+    if page_id is None:
+        line["error"] = "sin page_id para esta página"
+        return line
+    try:
+        base = page_base(master_id, version_id, page_id, group_id, page)
+        ruta_img = os.path.join(OUTPUT_DIR, f"{base}.png")
+        image.save(ruta_img, "PNG")
+        line["imagen"] = ruta_img
+        line.update(process_page(ruta_img, master_id, version_id, page_id, group_id, page,
+                                 model_dir, consolidate=False))
+    except Exception as e:
+        line["error"] = str(e)
+    return line
+
+
+def process_document(pdf_path: str, master_id, version_id, group_id, page_ids: List[str],
+                     model_dir: str) -> Iterator[Dict[str, Any]]:
+    """
+    Genera un dict por página (en orden de término) y uno final con el consolidado.
+    `page_ids[i]` es el document_pages.id de la página i+1.
+    """
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    n_pages = rasterizer.page_count(pdf_path)
+    yield {"tipo": "inicio", "master_id": master_id, "version_id": version_id,
+           "group_id": group_id, "paginas": n_pages}
+
+    n_ok, n_error, last_json = 0, 0, None
+
+    def finished(futures) -> Iterator[Dict[str, Any]]:
+        nonlocal n_ok, n_error, last_json
+        for fut in sorted(futures, key=lambda f: f.result()["page"]):
+            line = fut.result()
+            if "error" in line or line.get("semantic_status") != "ok":
+                n_error += 1
+            else:
+                n_ok += 1
+            if "json" in line:
+                last_json = os.path.basename(line["json"])
+            yield line
+
+    pending = set()
+    with ThreadPoolExecutor(max_workers=max(1, PIPELINE_WORKERS), thread_name_prefix="pipeline") as pool:
+        for page, image in rasterizer.iter_pages(pdf_path, last_page=n_pages):
+            page_id = page_ids[page - 1] if page - 1 < len(page_ids) else None
+            pending.add(pool.submit(_process_pdf_page, image, page, page_id,
+                                    master_id, version_id, group_id, model_dir))
+            del image
+            # entrega lo que ya terminó sin frenar la rasterización
+            done = {f for f in pending if f.done()}
+            pending -= done
+            yield from finished(done)
+            # acota las páginas rasterizadas en memoria
+            while len(pending) >= max(1, PIPELINE_MAX_INFLIGHT):
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from finished(done)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from finished(done)
+
+    # Consolidado doc-level: una sola vez, con todas las páginas ya indexadas
+    group_int = int(group_id) if group_id and str(group_id).isdigit() else None
+    consolidated = semantic.consolidate_document(int(master_id), int(version_id), group_int, archivo=last_json)
+    yield {
+        "tipo": "documento",
+        "paginas_ok": n_ok,
+        "paginas_error": n_error,
+        "semantic_status": consolidated["status"],
+        "semantic_logs": consolidated["logs"].strip()[:1000],
+    }
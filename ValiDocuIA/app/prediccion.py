@@ -1,11 +1,14 @@
 # prediccion.py — LayoutLMv3 inference robusto (word-level + chunking + logs)
-import os, json, random
-from typing import List, Tuple, Dict, Optional
+import os, json, random, threading, queue, time
+from concurrent.futures import Future
+from typing import List, Tuple, Dict, Optional, NamedTuple, Any
 import numpy as np
 import torch
 from PIL import Image, ImageDraw, ImageFont, UnidentifiedImageError
 import pytesseract
+import xxhash
 
+from app import ocr, backends
 from transformers import (
     LayoutLMv3Processor, LayoutLMv3ForTokenClassification,
     AutoTokenizer, LayoutLMv3ImageProcessor
@@ -17,8 +20,18 @@ BASE_PROCESSOR_ID   = os.getenv("PROCESSOR_BASE", "microsoft/layoutlmv3-base")
 DEFAULT_LANG        = os.getenv("OCR_LANG", "spa")
 DEFAULT_TESS_CONF   = os.getenv("TESS_CONFIG", "--oem 1 --psm 6")
 DEFAULT_MAX_LENGTH  = int(os.getenv("MAX_LENGTH", "384"))
-DEFAULT_CHUNK_WORDS = int(os.getenv("CHUNK_WORDS", "180"))
+DEFAULT_CHUNK_WORDS = int(os.getenv("CHUNK_WORDS", "0"))       # tope de palabras por chunk (0 = solo presupuesto de tokens)
+DEFAULT_CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "16"))  # palabras compartidas entre chunks vecinos
 DEFAULT_CONF_THRESH = float(os.getenv("CONF_THRESH", "0.50"))
+DEFAULT_BATCH_SIZE  = int(os.getenv("PRED_BATCH_SIZE", "8"))   # chunks por forward
+USE_SCHEDULER       = os.getenv("PRED_SCHEDULER", "1") == "1"  # batching entre peticiones
+SCHED_MAX_BATCH     = int(os.getenv("PRED_SCHED_MAX_BATCH", "16"))
+SCHED_WAIT_MS       = float(os.getenv("PRED_SCHED_WAIT_MS", "10"))
+DEFAULT_TEXT_ONLY   = os.getenv("PRED_TEXT_ONLY", "0") == "1"  # sin rama visual (solo texto + layout)
+WARMUP              = os.getenv("PRED_WARMUP", "1") == "1"     # páginas sintéticas antes de marcar listo
+WARMUP_LENGTHS      = [int(x) for x in os.getenv("PRED_WARMUP_LENGTHS", str(DEFAULT_MAX_LENGTH)).split(",") if x.strip()]
+# filas por forward a calentar: chunk suelto, batch de página y batch del scheduler
+WARMUP_ROWS         = sorted({1, DEFAULT_BATCH_SIZE, SCHED_MAX_BATCH} if USE_SCHEDULER else {1, DEFAULT_BATCH_SIZE})
 
 # ======== Utils ========
 def _clamp_box(b: List[int]) -> Optional[List[int]]:
@@ -41,20 +54,14 @@ def _clamp_box(b: List[int]) -> Optional[List[int]]:
 
 def _ocr_words_boxes(img: Image.Image, lang=DEFAULT_LANG, config=DEFAULT_TESS_CONF) -> Tuple[List[str], List[List[int]]]:
     W, H = img.size
-    data = pytesseract.image_to_data(img, lang=lang, config=config, output_type=pytesseract.Output.DICT)
+    # tesseract corre en el pool de procesos de app.ocr (coordenadas en px de la página)
+    tokens = ocr.words(img, lang=lang, config=config)
     words: List[str] = []
     boxes: List[List[int]] = []
-    for i in range(len(data.get("text", []))):
-        w = (data["text"][i] or "").strip()
-        if not w:
-            continue
+    for w, x, y, ww, hh in tokens:
         # descartamos cajas sin tamaño válido
-        ww = int(data["width"][i] or 0)
-        hh = int(data["height"][i] or 0)
         if ww <= 0 or hh <= 0:
             continue
-        x = int(data["left"][i] or 0)
-        y = int(data["top"][i] or 0)
         x0, y0, x1, y1 = x, y, x + ww, y + hh
         norm = _clamp_box([int(1000*x0/W), int(1000*y0/H), int(1000*x1/W), int(1000*y1/H)])
         if norm is None:
@@ -97,106 +104,462 @@ def _load_model_and_processor(model_root: str):
     id2label = model.config.id2label
     return model, processor, device, id2label
 
-# ======== Predicción por chunk con alineación palabra ← subtokens ========
-@torch.no_grad()
-def _predict_chunk(model, processor, device, image, words, boxes, max_length) -> Dict[str, np.ndarray]:
-    enc = processor(
-        image, words, boxes=boxes,
-        truncation=True, padding="max_length", max_length=max_length,
-        return_tensors="pt"
-    )
-    keys = ("input_ids", "bbox", "attention_mask", "pixel_values")
-    enc_in = {k: v.to(device) for k, v in enc.items() if k in keys}
-
-    logits = model(**enc_in).logits[0]  # (seq, C)
-    probs_tok = torch.softmax(logits, dim=-1).cpu().numpy()
-
-    word_ids = enc.word_ids(batch_index=0)  # lista token->word (None para CLS/SEP/PAD)
-    n_words = len(words)
-    C = probs_tok.shape[1]
-    sums   = np.zeros((n_words, C), dtype=np.float32)
-    counts = np.zeros((n_words,),    dtype=np.int32)
-
-    for tidx, wid in enumerate(word_ids):
-        if wid is None or wid >= n_words:
+# ======== Registro de modelos residentes (uno por ruta de checkpoint) ========
+class ModelBundle(NamedTuple):
+    model: LayoutLMv3ForTokenClassification
+    processor: LayoutLMv3Processor
+    device: torch.device
+    id2label: Dict[int, str]
+    backend: str = "eager"
+
+_REGISTRY: Dict[str, ModelBundle] = {}
+_REGISTRY_STATE: Dict[str, str] = {}          # ruta -> "loading" | "warming" | "ready" | "error: ..."
+_REGISTRY_LOCK = threading.Lock()
+_LOAD_LOCKS: Dict[str, threading.Lock] = {}
+
+def _registry_key(model_root: str) -> str:
+    return os.path.realpath(model_root)
+
+def get_model(model_root: Optional[str] = None) -> ModelBundle:
+    """Devuelve el modelo residente para `model_root`, cargándolo sólo la primera vez."""
+    model_root = model_root or DEFAULT_MODEL_DIR
+    key = _registry_key(model_root)
+    bundle = _REGISTRY.get(key)
+    if bundle is not None:
+        return bundle
+
+    with _REGISTRY_LOCK:
+        lock = _LOAD_LOCKS.setdefault(key, threading.Lock())
+    # un lock por checkpoint: peticiones concurrentes esperan la misma carga
+    with lock:
+        bundle = _REGISTRY.get(key)
+        if bundle is None:
+            _REGISTRY_STATE[key] = "loading"
+            try:
+                bundle = _activate_backend(model_root, ModelBundle(*_load_model_and_processor(model_root)))
+                bundle = bundle._replace(model=backends.compile_model(bundle.model, backends.PRED_COMPILE,
+                                                                      DEFAULT_MAX_LENGTH))
+                if WARMUP:
+                    # el modelo se publica (y /health/ pasa a listo) recién con las formas calientes
+                    _REGISTRY_STATE[key] = "warming"
+                    _warmup(bundle)
+            except Exception as e:
+                _REGISTRY_STATE[key] = f"error: {e}"
+                raise
+            _REGISTRY[key] = bundle
+            _REGISTRY_STATE[key] = "ready"
+            _log(f"modelo residente listo: {key}")
+    return bundle
+
+def _activate_backend(model_root: str, bundle: ModelBundle, name: str = backends.PRED_BACKEND) -> ModelBundle:
+    """Cambia el forward fp32 por el backend pedido si está validado para este checkpoint."""
+    if name != "eager" and bundle.device.type != "cpu":
+        _log(f"AVISO: backend {name} es solo CPU; usando eager en {bundle.device}")
+        return bundle
+    name = backends.resolve(model_root, name, checkpoint_version(model_root))
+    if name == "eager":
+        return bundle
+    _log(f"backend de inferencia: {name}")
+    return bundle._replace(model=backends.build(bundle.model, model_root, name), backend=name)
+
+def _warmup(bundle: ModelBundle) -> None:
+    """
+    Pasa una página sintética por cada forma habitual (max_length x filas x modo): inicializa
+    tokenizer e image processor, el allocator, la selección de kernels y, con PRED_COMPILE,
+    compila/traza los grafos. Así la primera petición real no paga ese costo.
+    """
+    t0 = time.perf_counter()
+    image = Image.new("RGB", (1700, 2200), "white")
+    words = [f"palabra{i}" for i in range(64)]
+    boxes = [[(i % 8) * 120 + 20, (i // 8) * 40 + 20, (i % 8) * 120 + 130, (i // 8) * 40 + 50] for i in range(64)]
+    pixel_values = _page_pixel_values(bundle.processor, image)
+    for max_length in WARMUP_LENGTHS:
+        for rows in WARMUP_ROWS:
+            for pv in (pixel_values, None):
+                _predict_chunks(bundle.model, bundle.processor, bundle.device, pv, [(words, boxes)] * rows, max_length)
+    _log(f"calentamiento listo en {time.perf_counter() - t0:.1f}s "
+         f"(max_length={WARMUP_LENGTHS}, filas={WARMUP_ROWS}, compile={backends.PRED_COMPILE or 'no'})")
+
+def preload_model(model_root: Optional[str] = None) -> None:
+    """Carga anticipada (startup). Los errores quedan registrados en el estado."""
+    try:
+        get_model(model_root)
+    except Exception as e:
+        _log(f"ERROR precargando modelo {model_root}: {e}")
+
+def is_model_ready(model_root: Optional[str] = None) -> bool:
+    return _registry_key(model_root or DEFAULT_MODEL_DIR) in _REGISTRY
+
+def unload_model(model_root: Optional[str] = None) -> None:
+    key = _registry_key(model_root or DEFAULT_MODEL_DIR)
+    _REGISTRY.pop(key, None)
+    _REGISTRY_STATE.pop(key, None)
+    _SCHEDULERS.pop(key, None)
+
+def registry_status() -> Dict[str, str]:
+    return dict(_REGISTRY_STATE)
+
+def backend_status() -> Dict[str, str]:
+    return {key: bundle.backend for key, bundle in _REGISTRY.items()}
+
+_MODEL_VERSIONS: Dict[str, str] = {}
+
+def checkpoint_version(model_root: Optional[str] = None) -> str:
+    """
+    Identidad del checkpoint (config + pesos por nombre/tamaño/mtime) y de los parámetros de
+    inferencia/OCR. MODEL_VERSION la fija a mano.
+    """
+    if os.getenv("MODEL_VERSION"):
+        return os.environ["MODEL_VERSION"]
+    key = _registry_key(model_root or DEFAULT_MODEL_DIR)
+    if key in _MODEL_VERSIONS:
+        return _MODEL_VERSIONS[key]
+    h = xxhash.xxh3_64()
+    for name in sorted(os.listdir(key)):
+        path = os.path.join(key, name)
+        if not os.path.isfile(path):
             continue
-        sums[wid]   += probs_tok[tidx]
-        counts[wid] += 1
+        if name.endswith(".json"):
+            with open(path, "rb") as f:
+                h.update(name.encode() + f.read())
+        else:
+            st = os.stat(path)
+            h.update(f"{name}:{st.st_size}:{st.st_mtime_ns}".encode())
+    h.update(f"{DEFAULT_MAX_LENGTH}:{DEFAULT_CHUNK_WORDS}:{DEFAULT_CHUNK_OVERLAP}:{DEFAULT_CONF_THRESH}:"
+             f"{DEFAULT_LANG}:{DEFAULT_TESS_CONF}".encode())
+    _MODEL_VERSIONS[key] = h.hexdigest()
+    return _MODEL_VERSIONS[key]
+
+def model_version(model_root: Optional[str] = None, text_only: bool = DEFAULT_TEXT_ONLY) -> str:
+    """Identidad de lo que produce el JSON de entidades: checkpoint, backend de inferencia y modo."""
+    model_root = model_root or DEFAULT_MODEL_DIR
+    bundle = _REGISTRY.get(_registry_key(model_root))
+    if bundle is not None:
+        backend = bundle.backend
+    else:
+        backend = backends.resolve(model_root, backends.PRED_BACKEND, checkpoint_version(model_root))
+    return (checkpoint_version(model_root)
+            + ("" if backend == "eager" else f":{backend}")
+            + (":texto" if text_only else ""))
+
+# ======== Scheduler de inferencia (micro-batching entre peticiones) ========
+class InferenceScheduler:
+    """
+    Cola única por modelo: las peticiones en curso encolan sus filas ya codificadas
+    (más "word_index"/"n_words" para la agregación por palabra) y un hilo las junta en
+    batches acotados por tamaño (filas) y tiempo de espera, hace un solo forward y
+    devuelve a cada Future (pred_ids, conf) de sus palabras.
+    """
+
+    def __init__(self, bundle: ModelBundle, max_batch: int = SCHED_MAX_BATCH, wait_ms: float = SCHED_WAIT_MS):
+        self.bundle = bundle
+        self.max_batch = max(1, max_batch)
+        self.wait_s = max(0.0, wait_ms) / 1000.0
+        self._queue: "queue.Queue[Tuple[Dict[str, torch.Tensor], Future]]" = queue.Queue()
+        self._carry: Optional[Tuple[Dict[str, torch.Tensor], Future]] = None  # solo lo usa el hilo del scheduler
+        self._thread = threading.Thread(target=self._run, name="layoutlm-scheduler", daemon=True)
+        self._thread.start()
+        self.batches = 0
+        self.rows = 0
+
+    def submit(self, enc_in: Dict[str, torch.Tensor]) -> Future:
+        fut: Future = Future()
+        self._queue.put((enc_in, fut))
+        return fut
+
+    def _collect(self) -> List[Tuple[Dict[str, torch.Tensor], Future]]:
+        # un item que no cupo en el batch anterior abre el siguiente
+        if self._carry is not None:
+            items, self._carry = [self._carry], None
+        else:
+            items = [self._queue.get()]
+        n_rows = len(items[0][0]["input_ids"])
+        deadline = time.monotonic() + self.wait_s
+        while n_rows < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            rows = len(item[0]["input_ids"])
+            if n_rows + rows > self.max_batch:
+                # no cabe: se guarda para el próximo batch (nunca más de max_batch filas por forward)
+                self._carry = item
+                break
+            items.append(item)
+            n_rows += rows
+        return [(enc, fut) for enc, fut in items if fut.set_running_or_notify_cancel()]
+
+    @torch.no_grad()
+    def _forward(self, items: List[Tuple[Dict[str, torch.Tensor], Future]]) -> None:
+        device = self.bundle.device
+        keys = list(items[0][0].keys())
+        enc_in = {k: torch.cat([enc[k] for enc, _ in items], dim=0).to(device) for k in keys}
+        word_index, n_words = enc_in.pop("word_index"), enc_in.pop("n_words")
+        logits = self.bundle.model(**enc_in).logits
+        pred_ids, confs = _aggregate_words(torch.softmax(logits, dim=-1), word_index, n_words)
+        self.batches += 1
+        self.rows += len(n_words)
+        start = 0
+        for enc, fut in items:
+            n = int(enc["n_words"].sum())
+            fut.set_result((pred_ids[start:start + n], confs[start:start + n]))
+            start += n
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            # sólo se concatenan filas con la misma forma (mismo max_length / mismas entradas)
+            groups: Dict[Any, List[Tuple[Dict[str, torch.Tensor], Future]]] = {}
+            for enc, fut in items:
+                sig = tuple((k, tuple(v.shape[1:])) for k, v in sorted(enc.items()))
+                groups.setdefault(sig, []).append((enc, fut))
+            for group in groups.values():
+                try:
+                    self._forward(group)
+                except Exception as e:
+                    for _, fut in group:
+                        if not fut.done():
+                            fut.set_exception(e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pendientes": self._queue.qsize() + (self._carry is not None),
+            "batches": self.batches,
+            "filas": self.rows,
+            "filas_por_batch": round(self.rows / self.batches, 2) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "espera_ms": self.wait_s * 1000.0,
+        }
+
+_SCHEDULERS: Dict[str, InferenceScheduler] = {}
+
+def get_scheduler(model_root: Optional[str] = None) -> InferenceScheduler:
+    model_root = model_root or DEFAULT_MODEL_DIR
+    key = _registry_key(model_root)
+    sched = _SCHEDULERS.get(key)
+    if sched is None:
+        bundle = get_model(model_root)
+        with _REGISTRY_LOCK:
+            sched = _SCHEDULERS.get(key)
+            if sched is None:
+                sched = _SCHEDULERS[key] = InferenceScheduler(bundle)
+    return sched
+
+def scheduler_status() -> Dict[str, Dict[str, Any]]:
+    return {key: sched.stats() for key, sched in _SCHEDULERS.items()}
+
+# ======== Chunking por presupuesto de tokens ========
+def _word_token_counts(tokenizer, words: List[str], boxes: List[List[int]]) -> List[int]:
+    """Subtokens de cada palabra, tokenizando la página una sola vez."""
+    enc = tokenizer(words, boxes=boxes, add_special_tokens=False, truncation=False)
+    if hasattr(enc, "word_ids") and getattr(enc, "encodings", None):
+        counts = [0] * len(words)
+        for wid in enc.word_ids():
+            if wid is not None:
+                counts[wid] += 1
+        return counts
+    # tokenizer lento: sin word_ids, se cuenta palabra a palabra
+    return [len(tokenizer.tokenize(w)) for w in words]
+
+def _token_budget_spans(counts: List[int], budget: int, overlap: int,
+                        max_words: int = 0) -> List[Tuple[int, int, int, int]]:
+    """
+    Empaqueta palabras consecutivas hasta llenar `budget` subtokens. Chunks vecinos comparten
+    hasta `overlap` palabras para que tengan contexto a ambos lados del corte; cada palabra
+    del solape se asigna al chunk del que queda más al centro.
+    Devuelve (a, b, own_a, own_b): rango del chunk y rango cuyas predicciones se usan.
+    """
+    n = len(counts)
+    ranges: List[Tuple[int, int]] = []
+    a = 0
+    while a < n:
+        b, used = a, 0
+        # una palabra más larga que el presupuesto va sola (se trunca, pero no se pierde)
+        while b < n and (b == a or used + counts[b] <= budget) and (not max_words or b - a < max_words):
+            used += counts[b]
+            b += 1
+        ranges.append((a, b))
+        if b >= n:
+            break
+        a = max(b - min(overlap, (b - a) // 2), a + 1)
+
+    spans = []
+    for i, (a, b) in enumerate(ranges):
+        own_a = a if i == 0 else (a + ranges[i - 1][1]) // 2
+        own_b = b if i == len(ranges) - 1 else (ranges[i + 1][0] + b) // 2
+        spans.append((a, b, own_a, own_b))
+    return spans
+
+# ======== Predicción por chunk con alineación palabra ← subtokens ========
+def _aggregate_words(probs_tok: torch.Tensor, word_index: torch.Tensor,
+                     n_words: torch.Tensor) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Promedio de las probabilidades de los subtokens de cada palabra (segment-mean con
+    index_add_) en el device del modelo, para todas las filas del batch a la vez.
+    probs_tok (R, S, C); word_index (R, S) con la palabra de cada token o -1; n_words (R,).
+    Sólo vuelven a CPU la clase y la confianza de cada palabra, concatenadas fila a fila.
+    """
+    C = probs_tok.shape[-1]
+    offsets = torch.cumsum(n_words, 0) - n_words
+    total = int(n_words.sum())
+    valid = (word_index >= 0) & (word_index < n_words[:, None])
+    gid = (word_index + offsets[:, None])[valid]
+
+    sums = torch.zeros((total, C), dtype=torch.float64, device=probs_tok.device)
+    sums.index_add_(0, gid, probs_tok[valid].to(torch.float64))
+    counts = torch.bincount(gid, minlength=total)
 
     # palabras que no recibieron subtokens (counts==0)
-    zero_mask = (counts == 0)
-    if zero_mask.any():
-        _log(f"AVISO: {int(zero_mask.sum())} palabra(s) sin tokens; forzando clase O")
+    zero_mask = counts == 0
+    n_zero = int(zero_mask.sum())
+    if n_zero:
+        _log(f"AVISO: {n_zero} palabra(s) sin tokens; forzando clase O")
         # fuerza prob válida con clase 0 (O)
-        sums[zero_mask, :] = 0.0
         sums[zero_mask, 0] = 1.0
-        counts[zero_mask]  = 1
+        counts = counts.clamp_min(1)
+
+    probs_word = sums / counts[:, None]
+    conf, pred_ids = probs_word.max(dim=-1)
+    return pred_ids.cpu().numpy(), conf.cpu().numpy()
 
-    probs_word = sums / counts[:, None]  # (n_words, C)
-    pred_ids   = probs_word.argmax(axis=-1)
-    return {"pred_ids": pred_ids, "probs_word": probs_word}
+def _page_pixel_values(processor, image: Image.Image) -> torch.Tensor:
+    """Resize + normalización de la página una sola vez: (1, 3, H, W) compartido por todos sus chunks."""
+    return processor.image_processor(image, return_tensors="pt")["pixel_values"]
+
+@torch.no_grad()
+def _predict_chunks(model, processor, device, pixel_values, chunks, max_length, scheduler=None) -> List[Dict[str, np.ndarray]]:
+    """
+    Codifica todos los chunks (words, boxes) de una página como un batch y hace un solo forward.
+    `pixel_values` es la imagen ya preprocesada de la página (ver _page_pixel_values); sólo se
+    tokeniza el texto. Con pixel_values=None el modelo corre sin rama visual (solo texto + layout).
+    Con `scheduler`, el forward se comparte con chunks de otras peticiones.
+    """
+    enc = processor.tokenizer(
+        [w for w, _ in chunks], boxes=[b for _, b in chunks],
+        truncation=True, padding="max_length", max_length=max_length,
+        return_tensors="pt"
+    )
+    if pixel_values is not None:
+        # misma imagen para cada fila: vista sin copiar
+        enc["pixel_values"] = pixel_values.expand(len(chunks), *pixel_values.shape[1:])
+    keys = ("input_ids", "bbox", "attention_mask", "pixel_values")
+    enc_in = {k: v for k, v in enc.items() if k in keys}
+    word_index = torch.tensor(
+        [[-1 if wid is None else wid for wid in enc.word_ids(batch_index=i)] for i in range(len(chunks))],
+        dtype=torch.long
+    )
+    n_words = torch.tensor([len(words) for words, _ in chunks], dtype=torch.long)
+    if scheduler is not None:
+        pred_ids, confs = scheduler.submit({**enc_in, "word_index": word_index, "n_words": n_words}).result()
+    else:
+        logits = model(**{k: v.to(device) for k, v in enc_in.items()}).logits  # (batch, seq, C)
+        pred_ids, confs = _aggregate_words(torch.softmax(logits, dim=-1), word_index.to(device), n_words.to(device))
+
+    # separa el batch: cada chunk recibe sus palabras
+    out, start = [], 0
+    for words, _ in chunks:
+        out.append({"pred_ids": pred_ids[start:start + len(words)], "conf": confs[start:start + len(words)]})
+        start += len(words)
+    return out
+
+def _predict_chunk(model, processor, device, pixel_values, words, boxes, max_length, scheduler=None) -> Dict[str, np.ndarray]:
+    return _predict_chunks(model, processor, device, pixel_values, [(words, boxes)], max_length, scheduler)[0]
+
+# ======== Predicción de una página (palabras -> clase y probabilidades por palabra) ========
+def _predict_page(bundle: ModelBundle, image: Image.Image, words: List[str], boxes: List[List[int]],
+                  max_length: int = DEFAULT_MAX_LENGTH, chunk_words: int = DEFAULT_CHUNK_WORDS,
+                  chunk_overlap: int = DEFAULT_CHUNK_OVERLAP, batch_size: int = DEFAULT_BATCH_SIZE,
+                  scheduler: Optional[InferenceScheduler] = None,
+                  text_only: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    model, processor, device, id2label = bundle.model, bundle.processor, bundle.device, bundle.id2label
+    pixel_values = None if text_only else _page_pixel_values(processor, image)
+    budget = max_length - processor.tokenizer.num_special_tokens_to_add()
+    counts = _word_token_counts(processor.tokenizer, words, boxes)
+    spans = _token_budget_spans(counts, budget, chunk_overlap, chunk_words)
+
+    if len(spans) == 1:
+        pred = _predict_chunk(model, processor, device, pixel_values, words, boxes, max_length, scheduler)
+        return pred["pred_ids"], pred["conf"]
+
+    _log(f"chunking por tokens: {len(words)} palabras / {sum(counts)} subtokens en {len(spans)} chunks "
+         f"de <= {budget} (solape={chunk_overlap}, batch={batch_size})")
+    # predicciones a nivel página; cada palabra sale del chunk que la "posee"
+    pred_ids_page = np.zeros((len(words),), dtype=np.int64)
+    conf_page     = np.zeros((len(words),), dtype=np.float64)  # conf 0 -> "O"
+    for b0 in range(0, len(spans), max(1, batch_size)):
+        group = spans[b0:b0 + max(1, batch_size)]
+        chunks = [(words[a:b], boxes[a:b]) for a, b, _, _ in group]
+        try:
+            preds = _predict_chunks(model, processor, device, pixel_values, chunks, max_length, scheduler)
+        except Exception as e:
+            _log(f"ERROR en batch de chunks {group[0][0]}:{group[-1][1]} -> {e}; reintentando chunk a chunk")
+            preds = []
+            for (a, b, _, _), (w_chunk, b_chunk) in zip(group, chunks):
+                try:
+                    preds.append(_predict_chunk(model, processor, device, pixel_values, w_chunk, b_chunk, max_length, scheduler))
+                except Exception as e2:
+                    _log(f"ERROR en chunk {a}:{b} -> {e2}")
+                    # continúa con el siguiente chunk
+                    preds.append(None)
+        for (a, b, own_a, own_b), pred in zip(group, preds):
+            if pred is None:
+                continue
+            pred_ids_page[own_a:own_b] = pred["pred_ids"][own_a - a:own_b - a]
+            conf_page[own_a:own_b]     = pred["conf"][own_a - a:own_b - a]
+    return pred_ids_page, conf_page
 
 # ======== Agrupación BIO a spans y unión de cajas por línea ========
-def _group_entities(words, boxes, pred_ids, probs_word, id2label, img_w, img_h, conf_thresh=DEFAULT_CONF_THRESH):
+def _scale_boxes(boxes: List[List[int]], img_w: int, img_h: int) -> List[List[int]]:
+    """Cajas 0..1000 -> píxeles de la imagen, todas de una vez."""
+    arr = np.asarray(boxes, dtype=np.int64) * np.array([img_w, img_h, img_w, img_h], dtype=np.int64)
+    return (arr / 1000).astype(np.int64).tolist()
+
+def _group_entities(words, boxes, pred_ids, confs, id2label, img_w, img_h, conf_thresh=DEFAULT_CONF_THRESH):
     def same_line(b1, b2, tol=6):
         return abs(b1[1]-b2[1]) <= tol and abs(b1[3]-b2[3]) <= tol
 
+    labels = [id2label.get(int(pid), "O") for pid in pred_ids]
+    confident = np.asarray(confs, dtype=np.float64) >= conf_thresh
+
     ents = []
     cur_lab = None
     cur_words, cur_boxes = [], []
 
-    for w, b, pid, pvec in zip(words, boxes, pred_ids, probs_word):
-        lab_idx = int(pid)
-        lab = id2label.get(lab_idx, "O")
-        conf = float(pvec.max())
-
-        if lab == "O" or conf < conf_thresh:
-            if cur_lab:
-                ents.append({
-                    "label": cur_lab,
-                    "text": " ".join(cur_words),
-                    "boxes": [[int(bx[0]*img_w/1000), int(bx[1]*img_h/1000),
-                               int(bx[2]*img_w/1000), int(bx[3]*img_h/1000)] for bx in cur_boxes]
-                })
-                cur_lab, cur_words, cur_boxes = None, [], []
+    def close():
+        if cur_lab:
+            ents.append({
+                "label": cur_lab,
+                "text": " ".join(cur_words),
+                "boxes": _scale_boxes(cur_boxes, img_w, img_h)
+            })
+
+    for w, b, lab, ok in zip(words, boxes, labels, confident):
+        if lab == "O" or not ok:
+            close()
+            cur_lab, cur_words, cur_boxes = None, [], []
             continue
 
         if lab.startswith("B-"):
-            if cur_lab:
-                ents.append({
-                    "label": cur_lab,
-                    "text": " ".join(cur_words),
-                    "boxes": [[int(bx[0]*img_w/1000), int(bx[1]*img_h/1000),
-                               int(bx[2]*img_w/1000), int(bx[3]*img_h/1000)] for bx in cur_boxes]
-                })
+            close()
             cur_lab   = lab[2:]
             cur_words = [w]
-            cur_boxes = [b]
+            cur_boxes = [list(b)]
 
         elif lab.startswith("I-") and cur_lab == lab[2:]:
             if cur_boxes and same_line(cur_boxes[-1], b):
                 cur_boxes[-1][2] = b[2]  # extiende x1 a la derecha
                 cur_words.append(w)
             else:
-                cur_boxes.append(b)
+                cur_boxes.append(list(b))
                 cur_words.append(w)
         else:
-            if cur_lab:
-                ents.append({
-                    "label": cur_lab,
-                    "text": " ".join(cur_words),
-                    "boxes": [[int(bx[0]*img_w/1000), int(bx[1]*img_h/1000),
-                               int(bx[2]*img_w/1000), int(bx[3]*img_h/1000)] for bx in cur_boxes]
-                })
+            close()
             cur_lab, cur_words, cur_boxes = None, [], []
 
-    if cur_lab:
-        ents.append({
-            "label": cur_lab,
-            "text": " ".join(cur_words),
-            "boxes": [[int(bx[0]*img_w/1000), int(bx[1]*img_h/1000),
-                       int(bx[2]*img_w/1000), int(bx[3]*img_h/1000)] for bx in cur_boxes]
-        })
+    close()
     return ents
 
 def _draw_entities(image, ents):
@@ -225,9 +588,12 @@ def run_prediction(
     *,
     max_length: int = DEFAULT_MAX_LENGTH,
     chunk_words: int = DEFAULT_CHUNK_WORDS,
+    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
     conf_thresh: float = DEFAULT_CONF_THRESH,
+    batch_size: int = DEFAULT_BATCH_SIZE,
     tess_lang: str = DEFAULT_LANG,
-    tess_config: str = DEFAULT_TESS_CONF
+    tess_config: str = DEFAULT_TESS_CONF,
+    text_only: bool = DEFAULT_TEXT_ONLY
 ):
     model_root = model_path or DEFAULT_MODEL_DIR
     if not os.path.isdir(model_root):
@@ -254,8 +620,10 @@ def run_prediction(
     except Exception as e:
         raise RuntimeError(f"Error abriendo la imagen: {e}")
 
-    # cargar modelo/processor
-    model, processor, device, id2label = _load_model_and_processor(model_root)
+    # modelo/processor residentes (se cargan una sola vez por proceso)
+    bundle = get_model(model_root)
+    id2label = bundle.id2label
+    scheduler = get_scheduler(model_root) if USE_SCHEDULER else None
 
     # OCR
     try:
@@ -281,25 +649,13 @@ def run_prediction(
     ents_all = []
     if len(words) == 0:
         _log("sin palabras -> se genera salida vacía")
-    elif len(words) > chunk_words:
-        _log(f"chunking por palabras: {len(words)} en bloques de {chunk_words}")
-        start = 0
-        while start < len(words):
-            end = min(start + chunk_words, len(words))
-            w_chunk = words[start:end]
-            b_chunk = boxes[start:end]
-            try:
-                pred = _predict_chunk(model, processor, device, image, w_chunk, b_chunk, max_length)
-                ents = _group_entities(w_chunk, b_chunk, pred["pred_ids"], pred["probs_word"], id2label, W, H, conf_thresh)
-                ents_all.extend(ents)
-            except Exception as e:
-                _log(f"ERROR en chunk {start}:{end} -> {e}")
-                # continúa con el siguiente chunk
-            start = end
     else:
+        if text_only:
+            _log("modo texto: sin rama visual")
         try:
-            pred = _predict_chunk(model, processor, device, image, words, boxes, max_length)
-            ents_all = _group_entities(words, boxes, pred["pred_ids"], pred["probs_word"], id2label, W, H, conf_thresh)
+            pred_ids, confs = _predict_page(bundle, image, words, boxes, max_length, chunk_words,
+                                            chunk_overlap, batch_size, scheduler, text_only)
+            ents_all = _group_entities(words, boxes, pred_ids, confs, id2label, W, H, conf_thresh)
         except Exception as e:
             _log(f"ERROR en pred/group: {e}")
             raise
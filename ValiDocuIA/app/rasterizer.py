@@ -0,0 +1,66 @@
+# rasterizer.py — PDF -> imágenes página a página (pdf2image/poppler)
+# -----------------------------------------------------------------------------
+# convert_from_path(pdf) sin rango deja TODAS las páginas a 300 DPI en memoria.
+# Aquí cada página se rasteriza por separado (first_page = last_page = n) en un pool
+# de POPPLER_THREADS procesos pdftoppm, con a lo sumo PDF_WINDOW_PAGES páginas
+# rasterizadas/en curso a la vez: la memoria queda acotada sin importar el largo del PDF.
+# -----------------------------------------------------------------------------
+import io
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional, Tuple
+
+from PIL import Image
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+from app import topology
+
+DEFAULT_DPI     = int(os.getenv("PDF_DPI", "300"))
+POPPLER_THREADS = int(os.getenv("POPPLER_THREADS", "2"))   # pdftoppm en paralelo
+WINDOW_PAGES    = int(os.getenv("PDF_WINDOW_PAGES", "4"))  # páginas en memoria como máximo
+
+
+def page_count(pdf_path: str) -> int:
+    return int(pdfinfo_from_path(pdf_path)["Pages"])
+
+
+def _render_page(pdf_path: str, n: int, dpi: int) -> Optional[Image.Image]:
+    pages = convert_from_path(pdf_path, dpi=dpi, first_page=n, last_page=n, thread_count=1)
+    return pages[0] if pages else None
+
+
+def iter_pages(pdf_path: str, dpi: int = DEFAULT_DPI,
+               first_page: int = 1, last_page: Optional[int] = None,
+               threads: int = POPPLER_THREADS, window: int = WINDOW_PAGES) -> Iterator[Tuple[int, Image.Image]]:
+    """
+    Entrega (n, imagen) en orden de página apenas cada una está lista.
+    Mientras el consumidor usa la página n, las siguientes ya se rasterizan en paralelo.
+    """
+    if last_page is None:
+        last_page = page_count(pdf_path)
+    threads = max(1, threads)
+    window = max(threads, window)
+
+    layout = topology.current()
+    cores = layout.poppler_cores if layout is not None and layout.pin else []
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="poppler",
+                            initializer=topology.poppler_thread_init, initargs=(cores,)) as pool:
+        pending = deque()
+        next_page = first_page
+        while next_page <= last_page or pending:
+            while next_page <= last_page and len(pending) < window:
+                pending.append((next_page, pool.submit(_render_page, pdf_path, next_page, dpi)))
+                next_page += 1
+            n, fut = pending.popleft()
+            image = fut.result()
+            if image is not None:
+                yield n, image
+            del fut, image
+
+
+def png_bytes(image: Image.Image) -> bytes:
+    """Codifica la página a PNG en memoria (sin pasar por disco)."""
+    buf = io.BytesIO()
+    image.save(buf, "PNG")
+    return buf.getvalue()
@@ -6,20 +6,36 @@
 # Acepta archivos: documento_{master}_{doc}_{group}_pNNNN.json
 #                  documento_{master}_{group}_pNNNN.json  (formato antiguo sin doc)
 # Inserta aunque falten columnas: detecta columnas presentes en cada tabla.
-# Retorna exit code 2 si no pudo conectar o escribir en BD (para que FastAPI lo reporte).
+# Escritura por upsert (INSERT ... ON CONFLICT si la clave tiene índice único; si no,
+# DELETE ... = ANY + INSERT multi-fila). La reindexación en bloque escribe en lotes de
+# SEM_BATCH_SIZE filas con commit por lote.
+# embedding: si la columna es pgvector se envía el float32 como literal vector (adaptador
+# PgVector) en vez de JSON; en columnas jsonb/json/text se mantiene el JSON.
+# `python app/semantic.py --indice [hnsw|ivfflat] [--reconstruir]` crea/mantiene el índice
+# ANN de semantic_doc_index.embedding; search_documents() hace el top-k que lo usa.
+# Uso como script: retorna exit code 2 si no pudo conectar o escribir en BD.
+# Uso como módulo (FastAPI): index_page() reutiliza modelo y pool de conexiones
+# residentes y devuelve {"status", "logs"} en vez de un exit code.
 # -----------------------------------------------------------------------------
 
 import os
 import json
 import psycopg2
+import psycopg2.pool
+import psycopg2.extras
+import psycopg2.extensions
 import re
 import sys
 import logging
+import threading
+from contextlib import contextmanager
 from datetime import datetime, date
-from collections import defaultdict
-from typing import List, Dict, Any, Tuple, Optional, Set
+from collections import defaultdict, OrderedDict
+from typing import List, Dict, Any, Tuple, Optional, Set, Callable
 import unicodedata
 
+import numpy as np
+
 try:
     from sentence_transformers import SentenceTransformer
 except Exception:
@@ -73,6 +89,15 @@ JSON_FOLDER = os.getenv("JSON_FOLDER", "outputs/")
 TABLE_NAME = os.getenv("SEM_TABLE", "semantic_index")                 # page-level (existente)
 DOC_TABLE_NAME = os.getenv("SEM_TABLE_DOC", "semantic_doc_index")     # doc-level (nuevo)
 WRITE_GLOBAL_FILE = os.getenv("SEM_WRITE_GLOBAL_FILE", "1") == "1"
+POOL_MIN_CONN = int(os.getenv("SEM_POOL_MIN", "1"))
+POOL_MAX_CONN = int(os.getenv("SEM_POOL_MAX", "4"))
+NORMALIZE_EMBEDDINGS = os.getenv("SEM_NORMALIZE", "0") == "1"  # vectores de norma 1 (coseno = producto interno)
+BATCH_SIZE = int(os.getenv("SEM_BATCH_SIZE", "200"))   # filas por lote (y por commit) al reindexar en bloque
+ANN_METHOD = os.getenv("SEM_ANN_METHOD", "hnsw")                # hnsw | ivfflat (índice de semantic_doc_index.embedding)
+ANN_EF_SEARCH = int(os.getenv("SEM_ANN_EF_SEARCH", "40"))       # hnsw.ef_search por consulta
+ANN_PROBES = int(os.getenv("SEM_ANN_PROBES", "10"))             # ivfflat.probes por consulta
+ANN_OVERSAMPLE = int(os.getenv("SEM_ANN_OVERSAMPLE", "4"))      # candidatos k x N antes de filtrar versiones vigentes
+ANN_MAX_CANDIDATES = int(os.getenv("SEM_ANN_MAX_CANDIDATES", "1000"))  # tope al duplicar candidatos si faltan vigentes
 
 DB_CONFIG = {
     "dbname": os.getenv("PG_DB", "validocu"),
@@ -536,62 +561,999 @@ def get_table_columns(cur, table_name: str) -> Set[str]:
     return cols
 
 
-def delete_then_insert_dynamic(cur, table: str, key_col: str, key_val, payload: Dict[str, Any], present_cols: Set[str]) -> bool:
+_COLUMNS_CACHE: Dict[str, Set[str]] = {}
+
+
+def get_table_columns_cached(cur, table_name: str) -> Set[str]:
+    """Columnas de la tabla, leídas de information_schema una sola vez por proceso."""
+    cols = _COLUMNS_CACHE.get(table_name)
+    if cols is None:
+        cols = get_table_columns(cur, table_name)
+        if cols:
+            _COLUMNS_CACHE[table_name] = cols
+    return cols
+
+
+_COLUMN_TYPES_CACHE: Dict[str, Dict[str, str]] = {}
+
+
+def _rollback_savepoint(cur, name: str) -> None:
+    """ROLLBACK TO SAVEPOINT que no lanza: si también falla (transacción abortada, conexión caída)
+    sólo se registra, para no tapar el error original ni escapar de quien devuelve un fallback."""
+    try:
+        cur.execute(f"ROLLBACK TO SAVEPOINT {name}")
+    except Exception as e:
+        logger.error(f"⚠️ No se pudo volver al savepoint {name}: {e}")
+
+
+def get_column_types_cached(cur, table_name: str) -> Dict[str, str]:
+    """columna -> tipo (udt_name: "vector", "jsonb", "text"...), leído una sola vez por proceso."""
+    types = _COLUMN_TYPES_CACHE.get(table_name)
+    if types is None:
+        types = {}
+        savepoint = False
+        try:
+            cur.execute("SAVEPOINT column_types")
+            savepoint = True
+            cur.execute("""
+                SELECT column_name, udt_name
+                FROM information_schema.columns
+                WHERE table_name = %s
+            """, (table_name,))
+            types = dict(cur.fetchall())
+            cur.execute("RELEASE SAVEPOINT column_types")
+        except Exception as e:
+            logger.error(f"⚠️ No se pudieron leer tipos de columnas de {table_name}: {e}")
+            if savepoint:
+                _rollback_savepoint(cur, "column_types")
+        if types:
+            _COLUMN_TYPES_CACHE[table_name] = types
+    return types
+
+
+class PgVector:
+    """Embedding float32 que psycopg2 envía como literal pgvector ('[...]'::vector), sin pasar por JSON."""
+
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype=np.float32).ravel()
+
+
+def _adapt_pgvector(v: PgVector):
+    # repr más corto que identifica cada float32 (≈ 10 caracteres por componente)
+    text = "[" + ",".join(str(x) for x in v.values) + "]"
+    return psycopg2.extensions.AsIs(psycopg2.extensions.adapt(text).getquoted().decode() + "::vector")
+
+
+psycopg2.extensions.register_adapter(PgVector, _adapt_pgvector)
+
+
+def encode_embedding(model, text: str) -> np.ndarray:
+    """Embedding float32 del texto (vacío sin modelo); normalizado con SEM_NORMALIZE=1."""
+    if not model:
+        return np.zeros((0,), dtype=np.float32)
+    return np.asarray(model.encode(text, normalize_embeddings=NORMALIZE_EMBEDDINGS), dtype=np.float32)
+
+
+def embedding_value(cur, table: str, embedding) -> Any:
     """
-    Borra por clave y re-inserta sólo columnas presentes en la tabla.
-    Devuelve True si pudo escribir, False si falló.
+    Valor a escribir en `table.embedding` según su tipo: PgVector para columnas pgvector
+    (NULL si no hay embedding) y JSON para jsonb/json/text (como antes).
+    `embedding` puede ser un array o el texto '[...]' copiado de otra fila.
     """
-    logger.debug(f"🗑️ DELETE FROM {table} WHERE {key_col} = {key_val}")
+    is_vector = cur is not None and get_column_types_cached(cur, table).get("embedding") == "vector"
+    if isinstance(embedding, str):
+        return embedding if (embedding.strip() not in ("", "[]") or not is_vector) else None
+    if is_vector:
+        return PgVector(embedding) if len(embedding) else None
+    return json.dumps([float(x) for x in embedding])
+
+
+_POOL: Optional[psycopg2.pool.ThreadedConnectionPool] = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool() -> Optional[psycopg2.pool.ThreadedConnectionPool]:
+    global _POOL
+    if _POOL is not None:
+        return _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            logger.info(f"🗄️ Creando pool Postgres ({POOL_MIN_CONN}-{POOL_MAX_CONN}) host={DB_CONFIG.get('host')} port={DB_CONFIG.get('port')} db={DB_CONFIG.get('dbname')}")
+            try:
+                _POOL = psycopg2.pool.ThreadedConnectionPool(POOL_MIN_CONN, POOL_MAX_CONN, **DB_CONFIG)
+            except Exception as e:
+                logger.error(f"❌ No se pudo crear el pool de Postgres: {e}")
+                return None
+    return _POOL
+
+
+@contextmanager
+def pooled_connection():
+    """Entrega (conn, cur) del pool; hace rollback si el bloque falla. (None, None) si no hay BD."""
+    pool = get_pool()
+    conn = None
+    if pool is not None:
+        try:
+            conn = pool.getconn()
+            if conn.closed:
+                pool.putconn(conn, close=True)
+                conn = pool.getconn()
+        except Exception as e:
+            logger.error(f"❌ No se pudo obtener conexión del pool: {e}")
+            conn = None
+    if conn is None:
+        yield None, None
+        return
+    cur = conn.cursor()
+    broken = False
     try:
-        cur.execute(f'DELETE FROM "{table}" WHERE "{key_col}" = %s', (key_val,))
-        logger.debug(f"  Filas eliminadas: {cur.rowcount}")
-    except Exception as e:
-        logger.error(f"❌ DELETE en {table} falló: {e}")
-        return False
+        yield conn, cur
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            broken = True
+        raise
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
+        pool.putconn(conn, close=broken or bool(conn.closed))
+
+
+_UNIQUE_KEY_CACHE: Dict[Tuple[str, str], bool] = {}
+
+
+def has_unique_key(cur, table: str, key_col: str) -> bool:
+    """¿Hay un índice único sobre `key_col` sólo? (requisito de ON CONFLICT). Se consulta una vez."""
+    cache_key = (table, key_col)
+    if cache_key not in _UNIQUE_KEY_CACHE:
+        savepoint = False
+        try:
+            cur.execute("SAVEPOINT unique_key")
+            savepoint = True
+            cur.execute("""
+                SELECT 1
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indrelid
+                JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = i.indkey[0]
+                WHERE c.relname = %s AND a.attname = %s
+                  AND i.indisunique AND i.indnatts = 1 AND i.indpred IS NULL
+                LIMIT 1
+            """, (table, key_col))
+            _UNIQUE_KEY_CACHE[cache_key] = cur.fetchone() is not None
+            cur.execute("RELEASE SAVEPOINT unique_key")
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo consultar índices de {table}: {e}")
+            if savepoint:
+                _rollback_savepoint(cur, "unique_key")
+            return False
+        logger.debug(f"📋 {table}.{key_col} único: {_UNIQUE_KEY_CACHE[cache_key]}")
+    return _UNIQUE_KEY_CACHE[cache_key]
+
+
+def _write_rows(cur, table: str, key_col: str, cols: List[str], rows: List[List[Any]]) -> None:
+    """
+    Escribe filas (misma lista de columnas, claves distintas) en un par de round-trips:
+    INSERT ... ON CONFLICT DO UPDATE si la clave es única, si no DELETE ... = ANY + INSERT multi-fila.
+    """
+    colnames = ", ".join(f'"{c}"' for c in cols)
+    insert = f'INSERT INTO "{table}" ({colnames}) VALUES %s'
+    if has_unique_key(cur, table, key_col):
+        updates = ", ".join(f'"{c}" = EXCLUDED."{c}"' for c in cols if c not in (key_col, "created_at"))
+        sql = f'{insert} ON CONFLICT ("{key_col}") DO ' + (f"UPDATE SET {updates}" if updates else "NOTHING")
+    else:
+        k = cols.index(key_col)
+        cur.execute(f'DELETE FROM "{table}" WHERE "{key_col}" = ANY(%s)', ([r[k] for r in rows],))
+        sql = insert
+    psycopg2.extras.execute_values(cur, sql, rows, page_size=max(1, len(rows)))
 
-    # Filtra payload por columnas presentes
+
+def upsert_dynamic(cur, table: str, key_col: str, key_val, payload: Dict[str, Any], present_cols: Set[str]) -> bool:
+    """
+    Reemplaza la fila de `key_val` escribiendo sólo columnas presentes en la tabla.
+    Devuelve True si pudo escribir, False si falló.
+    """
     cols = [c for c in payload.keys() if c in present_cols]
-    if not cols:
-        logger.warning(f"⚠️ Nada para insertar en {table}: ninguna de las columnas existe.")
+    if not cols or key_col not in cols:
+        logger.warning(f"⚠️ Nada para escribir en {table}: faltan columnas (o la clave {key_col}).")
         logger.debug(f"  Payload keys: {list(payload.keys())}")
         logger.debug(f"  Present cols: {list(present_cols)}")
         return False
 
-    placeholders = ", ".join(["%s"] * len(cols))
-    colnames = ", ".join(f'"{c}"' for c in cols)
-    sql = f'INSERT INTO "{table}" ({colnames}) VALUES ({placeholders})'
-    vals = [payload[c] for c in cols]
-
-    logger.debug(f"💾 INSERT en {table} con {len(cols)} columnas: {cols}")
+    logger.debug(f"💾 UPSERT en {table} ({key_col}={key_val}) con {len(cols)} columnas: {cols}")
+    savepoint = False
     try:
-        cur.execute(sql, vals)
-        logger.info(f"✅ INSERT en {table} exitoso")
+        cur.execute("SAVEPOINT upsert_row")
+        savepoint = True
+        _write_rows(cur, table, key_col, cols, [[payload[c] for c in cols]])
+        cur.execute("RELEASE SAVEPOINT upsert_row")
+        logger.info(f"✅ Escritura en {table} exitosa")
         return True
     except Exception as e:
-        logger.error(f"❌ INSERT en {table} falló: {e}")
-        logger.debug(f"  SQL: {sql}")
-        logger.debug(f"  Valores (primeros 3): {vals[:3]}")
+        logger.error(f"❌ Escritura en {table} falló: {e}")
+        if savepoint:
+            _rollback_savepoint(cur, "upsert_row")
         return False
 
 
+class BatchWriter:
+    """
+    Acumula filas por tabla y las escribe en lotes de `batch_size` (un upsert multi-fila por
+    lote). Con `conn` hace commit después de cada lote. Si un lote falla se reintenta fila a
+    fila: las filas buenas se escriben igual y las fallidas quedan en `failures`.
+    """
+
+    def __init__(self, cur, conn=None, batch_size: int = BATCH_SIZE):
+        self.cur = cur
+        self.conn = conn
+        self.batch_size = max(1, batch_size)
+        self._rows: Dict[Tuple[str, str, Tuple[str, ...]], Dict[Any, List[Any]]] = {}
+        self.batches = 0
+        self.rows_written = 0
+        self.failures: List[Dict[str, Any]] = []
+        self.ok = True
+
+    def add(self, table: str, key_col: str, key_val, payload: Dict[str, Any], present_cols: Set[str]) -> bool:
+        """Encola la fila (False sólo si no hay columnas que escribir); los fallos quedan en `failures`."""
+        cols = tuple(c for c in payload.keys() if c in present_cols)
+        if not cols or key_col not in cols:
+            logger.warning(f"⚠️ Nada para escribir en {table}: faltan columnas (o la clave {key_col}).")
+            return False
+        group = self._rows.setdefault((table, key_col, cols), {})
+        group[key_val] = [payload[c] for c in cols]  # la misma clave dos veces: gana la última
+        if len(group) >= self.batch_size:
+            self._flush_group((table, key_col, cols))
+        return True
+
+    def _flush_group(self, group_key) -> None:
+        table, key_col, cols = group_key
+        rows = self._rows.pop(group_key, {})
+        if not rows:
+            return
+        self.batches += 1
+        n = self.batches
+        savepoint = False
+        try:
+            self.cur.execute("SAVEPOINT sem_batch")
+            savepoint = True
+            _write_rows(self.cur, table, key_col, list(cols), list(rows.values()))
+            self.cur.execute("RELEASE SAVEPOINT sem_batch")
+            self.rows_written += len(rows)
+            logger.info(f"✅ Lote {n} en {table}: {len(rows)} filas")
+        except Exception as e:
+            if savepoint:
+                _rollback_savepoint(self.cur, "sem_batch")
+            logger.error(f"❌ Lote {n} en {table} ({len(rows)} filas) falló: {e} -> reintento fila a fila")
+            failed = []
+            for key_val, row in rows.items():
+                row_savepoint = False
+                try:
+                    self.cur.execute("SAVEPOINT sem_row")
+                    row_savepoint = True
+                    _write_rows(self.cur, table, key_col, list(cols), [row])
+                    self.cur.execute("RELEASE SAVEPOINT sem_row")
+                    self.rows_written += 1
+                except Exception as row_error:
+                    if row_savepoint:
+                        _rollback_savepoint(self.cur, "sem_row")
+                    failed.append((key_val, str(row_error)))
+            self.failures.append({"tabla": table, "lote": n, "filas": len(rows), "error": str(e),
+                                  "fallidas": [{key_col: k, "error": err} for k, err in failed]})
+            if failed:
+                self.ok = False
+                logger.error(f"  ✗ Lote {n}: {len(failed)} de {len(rows)} filas no se pudieron escribir")
+        if self.conn is not None:
+            try:
+                self.conn.commit()
+            except Exception as e:
+                self.ok = False
+                logger.error(f"❌ Commit del lote {n} en {table} falló: {e}")
+                self.failures.append({"tabla": table, "lote": n, "filas": len(rows), "error": f"commit: {e}"})
+
+    def flush(self) -> bool:
+        """Escribe lo pendiente; False si algún lote (de toda la corrida) dejó filas sin escribir."""
+        for group_key in list(self._rows.keys()):
+            self._flush_group(group_key)
+        return self.ok
+
+
+# =========================
+# Modelo residente
+# =========================
+_MODEL = None
+_MODEL_LOADED = False
+_MODEL_LOCK = threading.Lock()
+
+
+def get_model():
+    """SentenceTransformer compartido por el proceso (None si no está disponible)."""
+    global _MODEL, _MODEL_LOADED
+    if _MODEL_LOADED:
+        return _MODEL
+    with _MODEL_LOCK:
+        if not _MODEL_LOADED:
+            if SentenceTransformer is not None:
+                try:
+                    logger.info(f"🤖 Cargando modelo: {MODEL_NAME}")
+                    _MODEL = SentenceTransformer(MODEL_NAME)
+                    logger.info("✅ Modelo cargado exitosamente")
+                except Exception as e:
+                    logger.warning(f"⚠️ No se pudo cargar modelo {MODEL_NAME}: {e}")
+            else:
+                logger.warning("⚠️ sentence_transformers no disponible, embeddings estarán vacíos")
+            _MODEL_LOADED = True
+    return _MODEL
+
+
+# =========================
+# Procesamiento
+# =========================
+PAGE_FILE_RE = re.compile(r"^documento_(\d+)_(\d+)_(\d+)_(\w+)_p(\d+)$")
+
+
+def parse_page_filename(filename: str) -> Optional[Tuple[int, int, int, Optional[int], int]]:
+    """
+    documento_{master_id}_{version_id}_{page_id}_{group_id}_pNNNN.json
+    -> (master_id, version_id, page_id, group_id, page_number). group_id "loose" -> None.
+    """
+    if not filename.endswith(".json"):
+        return None
+    m = PAGE_FILE_RE.match(filename[:-5])
+    if not m:
+        return None
+    group_id_str = m.group(4)
+    group_id = int(group_id_str) if group_id_str.isdigit() else None
+    return int(m.group(1)), int(m.group(2)), int(m.group(3)), group_id, int(m.group(5))
+
+
+# =========================
+# Manifiesto de páginas por documento
+# =========================
+# Cada (master, version, group) tiene un manifiesto pequeño (número de página -> archivo)
+# que se actualiza a medida que se indexan sus páginas. El consolidado lee solo las
+# páginas de su documento, sin listar JSON_FOLDER, y los items ya parseados quedan en
+# memoria (validados por tamaño/mtime del archivo) para los consolidados siguientes.
+MANIFEST_DIR = os.getenv("SEM_MANIFEST_DIR", os.path.join(JSON_FOLDER, "manifests"))
+MANIFEST_CACHE_DOCS = int(os.getenv("SEM_MANIFEST_CACHE_DOCS", "64"))  # documentos con items en memoria
+
+DocKey = Tuple[int, int, Optional[int]]
+
+_MANIFEST_LOCK = threading.Lock()
+_MANIFESTS: "OrderedDict[DocKey, Dict[int, str]]" = OrderedDict()
+# archivo -> ((tamaño, mtime_ns), items); se descarta junto con su documento
+_PAGE_ITEMS: Dict[str, Tuple[Tuple[int, int], List[Dict[str, Any]]]] = {}
+_MIGRATED = False
+
+
+def _manifest_path(key: DocKey) -> str:
+    master_id, version_id, group_id = key
+    return os.path.join(MANIFEST_DIR, f"documento_{master_id}_{version_id}_{group_id}.manifest.json")
+
+
+def _read_manifest_file(key: DocKey) -> Optional[Dict[int, str]]:
+    try:
+        with open(_manifest_path(key), "r", encoding="utf-8") as f:
+            return {int(pg): fname for pg, fname in json.load(f)["pages"].items()}
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"⚠️ Manifiesto ilegible {_manifest_path(key)}: {e}")
+        return None
+
+
+def _write_manifest_file(key: DocKey, pages: Dict[int, str]) -> None:
+    path = _manifest_path(key)
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(MANIFEST_DIR, exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"pages": {str(pg): fname for pg, fname in sorted(pages.items())}}, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"⚠️ No se pudo escribir el manifiesto {path}: {e}")
+
+
+def _remember(key: DocKey, pages: Dict[int, str]) -> None:
+    # se llama con _MANIFEST_LOCK tomado
+    _MANIFESTS[key] = pages
+    _MANIFESTS.move_to_end(key)
+    while len(_MANIFESTS) > max(1, MANIFEST_CACHE_DOCS):
+        _, old_pages = _MANIFESTS.popitem(last=False)
+        for fname in old_pages.values():
+            _PAGE_ITEMS.pop(fname, None)
+
+
+def _file_stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def register_page(master_id: int, version_id: int, group_id: Optional[int], page_number: int,
+                  filename: str, items: Optional[List[Dict[str, Any]]] = None) -> None:
+    """Agrega (o reemplaza) una página en el manifiesto de su documento y cachea sus items."""
+    key = (master_id, version_id, group_id)
+    stamp = _file_stamp(os.path.join(JSON_FOLDER, filename))
+    with _MANIFEST_LOCK:
+        _migrate_manifests()
+        # se relee del disco: otro proceso pudo agregar páginas del mismo documento
+        pages = dict(_read_manifest_file(key) or _MANIFESTS.get(key) or {})
+        previous = pages.get(page_number)
+        if previous and previous != filename:
+            _PAGE_ITEMS.pop(previous, None)
+        pages[page_number] = filename
+        _write_manifest_file(key, pages)
+        _remember(key, pages)
+        if items is not None and stamp is not None:
+            _PAGE_ITEMS[filename] = (stamp, [dict(it) for it in items])
+
+
+def _migrate_manifests() -> None:
+    """
+    Documentos indexados antes de los manifiestos: un único listado de JSON_FOLDER arma los
+    manifiestos de todos y deja la marca MANIFEST_DIR/.completo. Desde entonces, un
+    documento sin manifiesto es un documento sin páginas indexadas.
+    """
+    # se llama con _MANIFEST_LOCK tomado
+    global _MIGRATED
+    if _MIGRATED:
+        return
+    marker = os.path.join(MANIFEST_DIR, ".completo")
+    if not os.path.exists(marker):
+        logger.info(f"📒 Creando manifiestos de documentos existentes en {JSON_FOLDER}...")
+        docs: Dict[DocKey, Dict[int, str]] = defaultdict(dict)
+        try:
+            names = os.listdir(JSON_FOLDER)
+        except OSError as e:
+            logger.error(f"❌ Error listando {JSON_FOLDER}: {e}")
+            names = []
+        for f in names:
+            if not (f.startswith("documento_") and f.endswith(".json")):
+                continue
+            # documento_{master_id}_{version_id}_{page_id}_{group_id}_pNNNN
+            # group_id puede ser número o "loose"
+            parsed = parse_page_filename(f)
+            if not parsed:
+                continue
+            file_master, file_version, _, file_group_id, file_page = parsed
+            docs[(file_master, file_version, file_group_id)][file_page] = f
+        for key, pages in docs.items():
+            merged = {**pages, **(_read_manifest_file(key) or {})}
+            _write_manifest_file(key, merged)
+        try:
+            os.makedirs(MANIFEST_DIR, exist_ok=True)
+            with open(marker, "w", encoding="utf-8") as f:
+                f.write(datetime.now().isoformat())
+        except OSError as e:
+            logger.warning(f"⚠️ No se pudo escribir {marker}: {e}")
+        logger.info(f"  ✓ {len(docs)} manifiestos creados")
+    _MIGRATED = True
+
+
+def _document_pages(key: DocKey) -> Dict[int, str]:
+    with _MANIFEST_LOCK:
+        _migrate_manifests()
+        # el archivo manda (otro proceso pudo agregar páginas); la memoria solo si no se puede leer
+        pages = _read_manifest_file(key)
+        if pages is None:
+            pages = _MANIFESTS.get(key, {})
+        _remember(key, pages)
+        return dict(pages)
+
+
+def document_page_count(master_id: int, version_id: int, group_id: Optional[int]) -> int:
+    """Páginas del documento ya indexadas (según su manifiesto)."""
+    return len(_document_pages((master_id, version_id, group_id)))
+
+
+def _page_items(filename: str) -> List[Dict[str, Any]]:
+    """Items de una página: de memoria si el archivo no cambió, si no se lee y se cachea."""
+    path = os.path.join(JSON_FOLDER, filename)
+    stamp = _file_stamp(path)
+    with _MANIFEST_LOCK:
+        cached = _PAGE_ITEMS.get(filename)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    with open(path, "r", encoding="utf-8") as fh:
+        items = json.load(fh)
+    if stamp is not None:
+        with _MANIFEST_LOCK:
+            _PAGE_ITEMS[filename] = (stamp, items)
+    return items
+
+
+def collect_document_items(master_id: int, version_id: int, group_id: Optional[int]) -> List[Dict[str, Any]]:
+    """Lee y concatena los items de todas las páginas del mismo master_id/version_id/group_id."""
+    logger.info("🔍 Buscando todas las páginas del mismo documento...")
+    all_items: List[Dict[str, Any]] = []
+    pages = _document_pages((master_id, version_id, group_id))
+    candidates = sorted(pages.items())
+    logger.info(f"  ✓ Encontradas {len(candidates)} páginas para master={master_id}, version={version_id}, group={group_id}")
+    logger.debug(f"  Páginas: {[pg for pg, _ in candidates]}")
+
+    for pg, f in candidates:
+        ppath = os.path.join(JSON_FOLDER, f)
+        try:
+            itms = _page_items(f)
+            logger.debug(f"    ✓ Página {pg}: {len(itms)} items")
+            for it in itms:
+                it = dict(it)
+                it.setdefault("page", pg)
+                all_items.append(it)
+        except Exception as e:
+            logger.error(f"❌ No se pudo leer {ppath}: {e}")
+    return all_items
+
+
+def index_page_level(cur, model, filename: str, page_cols: Set[str],
+                     writer: Optional[BatchWriter] = None) -> Tuple[bool, Optional[List[Dict[str, Any]]]]:
+    """
+    A) Escribe la fila page-level (semantic_index) de un archivo documento_*.json.
+    Con `writer` la fila se encola en su lote en vez de escribirse al momento.
+    Devuelve (escritura_ok, items_de_la_página); items None si el archivo no se pudo leer.
+    """
+    master_id, version_id, page_id, group_id, page_idx = parse_page_filename(filename)
+    current_page_json = os.path.join(JSON_FOLDER, filename)
+
+    # ----------------- A) Cargar SOLO la página actual (page-level) -----------------
+    logger.info("📖 Cargando JSON de la página...")
+    try:
+        with open(current_page_json, "r", encoding="utf-8") as f:
+            page_items = json.load(f)
+        logger.info(f"  ✓ JSON cargado: {len(page_items)} items detectados")
+        logger.debug(f"  Primeros 3 items: {page_items[:3]}")
+    except Exception as e:
+        logger.error(f"❌ No se pudo leer {current_page_json}: {e}")
+        return False, None
+
+    # Asegura 'page'
+    for it in page_items:
+        if "page" not in it:
+            it["page"] = page_idx
+
+    # la página entra al manifiesto de su documento (el consolidado no lista JSON_FOLDER)
+    register_page(master_id, version_id, group_id, page_idx, filename, page_items)
+
+    # Resumen/embedding por página (muy corto, opcional)
+    page_resumen = f"Página {page_idx} del documento {master_id} (grupo {group_id})."
+    logger.debug(f"  Resumen generado: {page_resumen}")
+
+    page_embedding = encode_embedding(model, page_resumen)
+    if model:
+        logger.debug(f"  Embedding generado: {len(page_embedding)} dimensiones")
+    page_embedding_sql = embedding_value(cur, TABLE_NAME, page_embedding)
+
+    page_json_layout_sql = json.dumps(page_items, ensure_ascii=False)
+    page_archivo = os.path.basename(current_page_json)
+
+    # Escribir page-level con document_version_id y document_page_id
+    logger.info(f"💾 Escribiendo en {TABLE_NAME}...")
+    if cur and page_id is not None:
+        payload_page = {
+            "document_version_id": version_id,
+            "document_page_id": page_id,
+            "document_group_id": group_id,
+            "resumen": page_resumen,
+            "json_layout": page_json_layout_sql,
+            "embedding": page_embedding_sql,  # pgvector nativo o JSON, según el tipo de la columna
+            "archivo": page_archivo,
+        }
+        logger.debug(f"  Payload keys: {list(payload_page.keys())}")
+        if writer is not None:
+            return writer.add(TABLE_NAME, "document_page_id", page_id, payload_page, page_cols), page_items
+        ok = upsert_dynamic(cur, TABLE_NAME, "document_page_id", page_id, payload_page, page_cols)
+        return ok, page_items
+
+    logger.warning("  ⚠️ No se puede escribir: cur o page_id es None")
+    return True, page_items
+
+
+def consolidate_doc_level(cur, model, master_id: int, version_id: int, group_id: Optional[int],
+                          archivo: Optional[str], doc_cols: Set[str],
+                          fallback_items: Optional[List[Dict[str, Any]]] = None,
+                          writer: Optional[BatchWriter] = None) -> Optional[bool]:
+    """
+    B-D) Reconstruye json_global/resumen con todas las páginas del documento y escribe
+    semantic_doc_index (o la encola en `writer`). Devuelve None si no había items que consolidar.
+    """
+    # ------------- B) Recolectar TODAS las páginas del mismo master_id/version_id/group_id -------------
+    try:
+        all_items = collect_document_items(master_id, version_id, group_id)
+    except Exception as e:
+        logger.error(f"❌ Error listando páginas: {e}")
+        # en caso extremo, al menos usa la página actual
+        all_items = (fallback_items or [])[:]
+
+    if not all_items:
+        logger.warning("⚠️ No hay items para consolidar en doc-level, saltando...")
+        return None
+
+    logger.info(f"  ✓ Total items consolidados: {len(all_items)}")
+
+    # ------------- C) Construir json_global y resumen global (doc-level) -------------
+    logger.info("🏗️ Construyendo json_global y resumen consolidado...")
+    json_global = build_json_global(all_items)
+    logger.info(f"  ✓ json_global construido: {len(json_global)} labels únicos")
+    logger.debug(f"  Labels: {list(json_global.keys())}")
+
+    resumen = build_resumen(json_global)
+    logger.info(f"  ✓ Resumen generado: {len(resumen)} caracteres")
+    logger.debug(f"  Resumen preview: {resumen[:200]}...")
+
+    embedding_resumen = encode_embedding(model, resumen)
+    if model:
+        logger.debug(f"  ✓ Embedding del resumen: {len(embedding_resumen)} dimensiones")
+    json_layout_global_sql = json.dumps(all_items, ensure_ascii=False)
+    json_global_sql = json.dumps(json_global, ensure_ascii=False)
+
+    # (opcional) archivo global auxiliar
+    if WRITE_GLOBAL_FILE:
+        out_global = os.path.join(JSON_FOLDER, f"documento_{master_id}_{version_id}_{group_id}_global.json")
+        try:
+            with open(out_global, "w", encoding="utf-8") as g:
+                json.dump(json_global, g, ensure_ascii=False, indent=2)
+            logger.info(f"  ✓ Archivo global escrito: {out_global}")
+        except Exception as e:
+            logger.error(f"❌ No se pudo escribir {out_global}: {e}")
+
+    # ------------- D) Escribir doc-level en semantic_doc_index -------------
+    logger.info(f"💾 Escribiendo en {DOC_TABLE_NAME}...")
+    if not cur:
+        return True
+    payload_doc = {
+        "document_version_id": version_id,
+        "document_group_id": group_id,
+        "resumen": resumen,
+        "json_layout": json_layout_global_sql,
+        "json_global": json_global_sql,
+        "embedding": embedding_value(cur, DOC_TABLE_NAME, embedding_resumen),
+        "archivo": archivo,
+        "updated_at": datetime.utcnow().isoformat(),  # si no existe, se ignora
+        "created_at": datetime.utcnow().isoformat(),  # si no existe, se ignora
+    }
+    logger.debug(f"  Payload doc-level: {list(payload_doc.keys())}")
+    if writer is not None:
+        return writer.add(DOC_TABLE_NAME, "document_version_id", version_id, payload_doc, doc_cols)
+    ok = upsert_dynamic(cur, DOC_TABLE_NAME, "document_version_id", version_id, payload_doc, doc_cols)
+    if ok:
+        logger.info(f"✅ Doc-level actualizado (master={master_id}, version={version_id}, group={group_id})")
+    return ok
+
+
+def process_files(targets: List[str], cur, model, page_cols: Set[str], doc_cols: Set[str],
+                  consolidate: bool = True, writer: Optional[BatchWriter] = None) -> Tuple[int, int, bool]:
+    """
+    Indexa cada archivo (page-level) y, si `consolidate`, consolida cada documento tocado
+    (doc-level) una sola vez, después de escribir todas sus páginas.
+    Con `writer` las filas se escriben (y commitean) por lotes; al final se vacía.
+    Devuelve (procesados, errores, escritura_ok). Sin `writer` no hace commit.
+    """
+    DB_WRITE_OK = True
+    # (master, version, group) -> (último archivo, items de esa página)
+    documents: Dict[DocKey, Tuple[str, List[Dict[str, Any]]]] = {}
+
+    processed_count = 0
+    error_count = 0
+
+    for idx, filename in enumerate(targets, 1):
+        logger.info("="*80)
+        logger.info(f"📄 [{idx}/{len(targets)}] Procesando: {filename}")
+
+        # Solo aceptamos prefijo documento_
+        if not filename.endswith(".json") or not filename.startswith("documento_"):
+            logger.warning(f"⚠️ Archivo ignorado (formato incorrecto): {filename}")
+            continue
+
+        # Formato: documento_{master_id}_{version_id}_{page_id}_{group_id}_pNNNN
+        # group_id puede ser un número o "loose" para documentos sueltos
+        parsed = parse_page_filename(filename)
+        if not parsed:
+            logger.error(f"❌ Nombre de archivo inválido: {filename}")
+            logger.error(f"  Formato esperado: documento_{{master}}_{{version}}_{{page_id}}_{{group|loose}}_pNNNN.json")
+            error_count += 1
+            continue
+
+        master_id, version_id, page_id, group_id, page_idx = parsed
+        logger.info(f"  📌 master_id={master_id}")
+        logger.info(f"  📌 version_id={version_id}")
+        logger.info(f"  📌 page_id={page_id}")
+        logger.info(f"  📌 group_id={group_id}")
+        logger.info(f"  📌 page_number={page_idx}")
+
+        ok, page_items = index_page_level(cur, model, filename, page_cols, writer)
+        if page_items is None:
+            error_count += 1
+            continue
+        DB_WRITE_OK = DB_WRITE_OK and ok
+        if ok:
+            processed_count += 1
+        else:
+            error_count += 1
+
+        documents[(master_id, version_id, group_id)] = (filename, page_items)
+
+    if consolidate:
+        for (master_id, version_id, group_id), (filename, page_items) in documents.items():
+            logger.info("="*80)
+            ok = consolidate_doc_level(cur, model, master_id, version_id, group_id, filename, doc_cols,
+                                       page_items, writer)
+            if ok is None:
+                continue
+            DB_WRITE_OK = DB_WRITE_OK and ok
+            if not ok:
+                error_count += 1
+
+    if writer is not None:
+        DB_WRITE_OK = writer.flush() and DB_WRITE_OK
+        error_count += sum(len(f.get("fallidas", [])) for f in writer.failures)
+        logger.info(f"📦 {writer.rows_written} filas en {writer.batches} lotes de hasta {writer.batch_size}")
+        for f in writer.failures:
+            logger.error(f"  ✗ {f['tabla']} lote {f['lote']} ({f['filas']} filas): {f['error']}")
+            for row in f.get("fallidas", []):
+                logger.error(f"    - {row}")
+
+    return processed_count, error_count, DB_WRITE_OK
+
+
+class _ThreadLogCapture(logging.Handler):
+    """Captura los logs emitidos por el hilo actual (equivale al stdout/stderr del subproceso)."""
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.thread_id = threading.get_ident()
+        self.lines: List[str] = []
+        self.setFormatter(logging.Formatter('%(levelname)s - %(message)s'))
+
+    def emit(self, record):
+        if record.thread == self.thread_id:
+            self.lines.append(self.format(record))
+
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+
+def _run_in_pool(action: Callable[[Any, Any], bool], desc: str) -> Dict[str, Any]:
+    """
+    Ejecuta `action(cur, model)` con una conexión del pool, hace commit y captura los logs.
+    Devuelve {"status": "ok"|"error", "logs": str} (equivalente al exit code del script).
+    """
+    capture = _ThreadLogCapture()
+    logger.addHandler(capture)
+    try:
+        model = get_model()
+        with pooled_connection() as (conn, cur):
+            if cur is None:
+                logger.error("❌ No hay conexión a BD - ABORTANDO")
+                return {"status": "error", "logs": capture.text()}
+            write_ok = action(cur, model)
+            try:
+                conn.commit()
+                logger.info("✅ COMMIT exitoso - Cambios guardados en BD")
+            except Exception as e:
+                logger.error(f"❌ Error al hacer commit: {e}")
+                write_ok = False
+            if not write_ok:
+                logger.error("❌ Falló alguna escritura en BD")
+        return {"status": "ok" if write_ok else "error", "logs": capture.text()}
+    except Exception as e:
+        logger.error(f"❌ Error en {desc}: {e}")
+        return {"status": "error", "logs": capture.text()}
+    finally:
+        logger.removeHandler(capture)
+
+
+def index_page(json_path: str, consolidate: bool = True) -> Dict[str, Any]:
+    """
+    Indexa una página ya predicha dentro del proceso que llama (FastAPI), reutilizando
+    el modelo y el pool de conexiones residentes. Con consolidate=False sólo escribe la
+    fila page-level (el consolidado se hace luego con consolidate_document()).
+    """
+    filename = os.path.basename(json_path)
+
+    def action(cur, model) -> bool:
+        logger.info(f"🎯 Procesando archivo específico: {filename}")
+        page_cols = get_table_columns_cached(cur, TABLE_NAME)
+        doc_cols = get_table_columns_cached(cur, DOC_TABLE_NAME)
+        _, _, write_ok = process_files([filename], cur, model, page_cols, doc_cols, consolidate)
+        return write_ok
+
+    return _run_in_pool(action, f"indexación de {json_path}")
+
+
+def consolidate_document(master_id: int, version_id: int, group_id: Optional[int],
+                         archivo: Optional[str] = None) -> Dict[str, Any]:
+    """Reconstruye una sola vez la fila doc-level (semantic_doc_index) de un documento."""
+    def action(cur, model) -> bool:
+        logger.info(f"📚 Consolidando documento master={master_id}, version={version_id}, group={group_id}")
+        doc_cols = get_table_columns_cached(cur, DOC_TABLE_NAME)
+        ok = consolidate_doc_level(cur, model, master_id, version_id, group_id, archivo, doc_cols)
+        return ok is not False
+
+    return _run_in_pool(action, f"consolidación de versión {version_id}")
+
+
+# =========================
+# Índice ANN y búsqueda top-k (semantic_doc_index)
+# =========================
+# La búsqueda de Laravel calcula 1 - (embedding <=> q) para todas las filas y filtra por
+# score: ningún índice aplica. Un índice HNSW/IVFFlat (vector_cosine_ops) solo se usa con
+# ORDER BY embedding <=> q LIMIT n directamente sobre la tabla; search_documents() pide así
+# k x SEM_ANN_OVERSAMPLE candidatos, se queda con las versiones vigentes y filtra por score
+# (duplicando los candidatos hasta SEM_ANN_MAX_CANDIDATES si no alcanzan para k).
+ANN_INDEX_NAME = f"idx_{DOC_TABLE_NAME}_embedding_ann"
+
+
+def _pgvector_version(cur) -> Tuple[int, ...]:
+    cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+    row = cur.fetchone()
+    return tuple(int(x) for x in re.findall(r"\d+", row[0])) if row else ()
+
+
+def ann_index_status(cur) -> Dict[str, Any]:
+    """Definición del índice ANN (si existe), versión de pgvector y filas indexables."""
+    cur.execute("SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname = %s",
+                (DOC_TABLE_NAME, ANN_INDEX_NAME))
+    row = cur.fetchone()
+    cur.execute(f'SELECT count(*) FROM "{DOC_TABLE_NAME}" WHERE "embedding" IS NOT NULL')
+    rows = cur.fetchone()[0]
+    version = _pgvector_version(cur)
+    definition = row[0] if row else None
+    method = None
+    lists = None
+    if definition:
+        method = "hnsw" if "USING hnsw" in definition else "ivfflat" if "USING ivfflat" in definition else "otro"
+        m = re.search(r"lists\s*=\s*'?(\d+)", definition)
+        lists = int(m.group(1)) if m else None
+    return {"indice": ANN_INDEX_NAME, "definicion": definition, "metodo": method, "lists": lists,
+            "filas": rows, "pgvector": ".".join(map(str, version)) or None}
+
+
+def _ivfflat_lists(rows: int) -> int:
+    # recomendación de pgvector: filas/1000 hasta 1M filas, raíz de filas por encima
+    return max(1, rows // 1000) if rows <= 1_000_000 else int(rows ** 0.5)
+
+
+def ensure_ann_index(cur, method: str = ANN_METHOD, rebuild: bool = False,
+                     m: int = 16, ef_construction: int = 64) -> Dict[str, Any]:
+    """
+    Crea (o mantiene) el índice ANN de semantic_doc_index.embedding:
+      - hnsw (pgvector >= 0.5.0; si no, se usa ivfflat): se mantiene solo con cada INSERT;
+      - ivfflat: `lists` depende del número de filas, así que se reconstruye cuando la tabla
+        creció/encogió más del doble respecto de lo que el índice asumió.
+    `rebuild` fuerza DROP + CREATE. Devuelve el estado final y la acción tomada.
+    """
+    status = ann_index_status(cur)
+    version = _pgvector_version(cur)
+    if method == "hnsw" and version < (0, 5, 0):
+        logger.warning(f"⚠️ pgvector {status['pgvector']} no soporta HNSW; se usa IVFFlat")
+        method = "ivfflat"
+
+    target_lists = _ivfflat_lists(status["filas"])
+    action = "sin cambios"
+    if status["definicion"] and not rebuild:
+        if status["metodo"] != method:
+            rebuild, action = True, f"cambio de método {status['metodo']} -> {method}"
+        elif method == "ivfflat" and status["lists"] and not (
+                status["lists"] / 2 <= target_lists <= status["lists"] * 2):
+            rebuild, action = True, f"lists {status['lists']} -> {target_lists}"
+    if status["definicion"] and rebuild:
+        cur.execute(f'DROP INDEX IF EXISTS "{ANN_INDEX_NAME}"')
+    if not status["definicion"] or rebuild:
+        if method == "hnsw":
+            options = f"(m = {int(m)}, ef_construction = {int(ef_construction)})"
+        else:
+            options = f"(lists = {target_lists})"
+        logger.info(f"🧭 Creando índice {method} {options} sobre {DOC_TABLE_NAME}.embedding ({status['filas']} filas)")
+        cur.execute(f'CREATE INDEX "{ANN_INDEX_NAME}" ON "{DOC_TABLE_NAME}" '
+                    f'USING {method} ("embedding" vector_cosine_ops) WITH {options}')
+        action = action if action != "sin cambios" else ("reconstruido" if status["definicion"] else "creado")
+    cur.execute(f'ANALYZE "{DOC_TABLE_NAME}"')
+    return {**ann_index_status(cur), "accion": action}
+
+
+SEARCH_SQL = f"""
+    SELECT nn.id, nn.resumen, nn.archivo, nn.document_group_id,
+           dv.document_id, dv.filename AS document_name,
+           g.name AS group_name,
+           dv.due_date AS due_date,
+           dv.normative_gap AS normative_gap,
+           1 - nn.distance AS score,
+           dv.id IS NOT NULL AS vigente
+    FROM (
+        SELECT sdi.id, sdi.resumen, sdi.archivo, sdi.document_group_id, sdi.document_version_id,
+               sdi.embedding <=> %(q)s AS distance
+        FROM "{DOC_TABLE_NAME}" sdi
+        WHERE sdi.embedding IS NOT NULL
+        ORDER BY sdi.embedding <=> %(q)s
+        LIMIT %(candidates)s
+    ) AS nn
+    LEFT JOIN document_versions dv ON dv.id = nn.document_version_id AND dv.is_current = true
+    LEFT JOIN document_groups g ON g.id = nn.document_group_id
+    ORDER BY nn.distance
+"""
+
+
+def search_documents_cur(cur, embedding, k: int = 10, min_score: float = 0.4) -> Dict[str, Any]:
+    """
+    Top-k de semantic_doc_index (solo versiones vigentes) por similitud coseno, usando el
+    índice ANN si existe. El índice ordena todas las versiones: se piden k x SEM_ANN_OVERSAMPLE
+    candidatos y, si tras descartar versiones no vigentes quedan menos de k sobre min_score,
+    se repite con el doble de candidatos hasta SEM_ANN_MAX_CANDIDATES.
+    Devuelve {"resultados", "candidatos", "incompleto"}; incompleto=True si se llegó al tope
+    y todavía podía haber resultados válidos más allá.
+    """
+    k = int(k)
+    cap = max(k, ANN_MAX_CANDIDATES)
+    candidates = min(cap, k * max(1, ANN_OVERSAMPLE))
+    q = PgVector(embedding)
+    while True:
+        # parámetros de búsqueda del índice, solo para esta transacción (ef_search <= 1000 en pgvector)
+        cur.execute("SELECT set_config('hnsw.ef_search', %s, true), set_config('ivfflat.probes', %s, true)",
+                    (str(min(1000, max(ANN_EF_SEARCH, candidates))), str(ANN_PROBES)))
+        cur.execute(SEARCH_SQL, {"q": q, "candidates": candidates})
+        cols = [d[0] for d in cur.description]
+        rows = [dict(zip(cols, row)) for row in cur.fetchall()]
+        results = [r for r in rows if r["vigente"] and r["score"] >= min_score][:k]
+        exhausted = len(rows) < candidates                      # no hay más filas que ver
+        below = bool(rows) and rows[-1]["score"] < min_score    # las siguientes quedan bajo min_score
+        if len(results) >= k or exhausted or below or candidates >= cap:
+            break
+        candidates = min(cap, candidates * 2)
+    for r in results:
+        r.pop("vigente", None)
+    incomplete = len(results) < k and not (exhausted or below)
+    if incomplete:
+        logger.warning(f"⚠️ Búsqueda top-{k}: {len(results)} resultados tras {candidates} candidatos "
+                       f"(tope SEM_ANN_MAX_CANDIDATES); versiones no vigentes ocupan el resto")
+    return {"resultados": results, "candidatos": candidates, "incompleto": incomplete}
+
+
+def search_documents(embedding, k: int = 10, min_score: float = 0.4) -> Dict[str, Any]:
+    """search_documents_cur con una conexión del pool (uso desde FastAPI)."""
+    with pooled_connection() as (conn, cur):
+        if cur is None:
+            raise RuntimeError("sin conexión a BD")
+        try:
+            return search_documents_cur(cur, embedding, k, min_score)
+        finally:
+            conn.rollback()  # solo lectura: descarta los set_config locales
+
+
+def main_index(args: List[str]) -> None:
+    """python app/semantic.py --indice [hnsw|ivfflat] [--reconstruir]"""
+    method = next((a for a in args if a in ("hnsw", "ivfflat")), ANN_METHOD)
+    conn, cur = connect_db()
+    if cur is None:
+        logger.error("❌ No hay conexión a BD - ABORTANDO")
+        sys.exit(2)
+    try:
+        status = ensure_ann_index(cur, method, rebuild="--reconstruir" in args)
+        conn.commit()
+    except Exception as e:
+        logger.error(f"❌ No se pudo crear/mantener el índice ANN: {e}")
+        conn.rollback()
+        sys.exit(2)
+    finally:
+        conn.close()
+    logger.info(f"✅ Índice ANN: {json.dumps(status, ensure_ascii=False)}")
+    sys.exit(0)
+
+
 # =========================
 # Main
 # =========================
 def main():
     logger.info("="*80)
     logger.info("📋 Iniciando procesamiento de documentos")
-    
-    # Modelo (si existe sentence_transformers, si no, usa embedding vacío)
-    model = None
-    if SentenceTransformer is not None:
-        try:
-            logger.info(f"🤖 Cargando modelo: {MODEL_NAME}")
-            model = SentenceTransformer(MODEL_NAME)
-            logger.info("✅ Modelo cargado exitosamente")
-        except Exception as e:
-            logger.warning(f"⚠️ No se pudo cargar modelo {MODEL_NAME}: {e}")
-    else:
-        logger.warning("⚠️ sentence_transformers no disponible, embeddings estarán vacíos")
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--indice":
+        main_index(sys.argv[2:])
+
+    model = get_model()
 
     # Archivos objetivo
     if len(sys.argv) > 1:
@@ -612,7 +1574,6 @@ def main():
 
     conn, cur = connect_db()
     DB_OK = cur is not None
-    DB_WRITE_OK = True
 
     if not DB_OK:
         logger.error("❌ No hay conexión a BD - ABORTANDO")
@@ -628,198 +1589,10 @@ def main():
     else:
         page_cols, doc_cols = set(), set()
 
-    processed_count = 0
-    error_count = 0
-
-    for idx, filename in enumerate(targets, 1):
-        logger.info("="*80)
-        logger.info(f"📄 [{idx}/{len(targets)}] Procesando: {filename}")
-        
-        # Solo aceptamos prefijo documento_
-        if not filename.endswith(".json") or not filename.startswith("documento_"):
-            logger.warning(f"⚠️ Archivo ignorado (formato incorrecto): {filename}")
-            continue
-
-        name_wo_ext = filename[:-5]  # sin .json
-
-        # Formato: documento_{master_id}_{version_id}_{page_id}_{group_id}_pNNNN
-        # group_id puede ser un número o "loose" para documentos sueltos
-        m = re.match(r"^documento_(\d+)_(\d+)_(\d+)_(\w+)_p(\d+)$", name_wo_ext)
-
-        if m:
-            master_id = int(m.group(1))
-            version_id = int(m.group(2))
-            page_id = int(m.group(3))
-            group_id_str = m.group(4)
-            # Convertir group_id a int si es numérico, None si es "loose"
-            group_id = int(group_id_str) if group_id_str.isdigit() else None
-            page_idx = int(m.group(5))
-            logger.info(f"  📌 master_id={master_id}")
-            logger.info(f"  📌 version_id={version_id}")
-            logger.info(f"  📌 page_id={page_id}")
-            logger.info(f"  📌 group_id={group_id} (original: {group_id_str})")
-            logger.info(f"  📌 page_number={page_idx}")
-        else:
-            logger.error(f"❌ Nombre de archivo inválido: {filename}")
-            logger.error(f"  Formato esperado: documento_{{master}}_{{version}}_{{page_id}}_{{group|loose}}_pNNNN.json")
-            error_count += 1
-            continue
-
-        current_page_json = os.path.join(JSON_FOLDER, filename)
-
-        # ----------------- A) Cargar SOLO la página actual (page-level) -----------------
-        logger.info("📖 Cargando JSON de la página...")
-        try:
-            with open(current_page_json, "r", encoding="utf-8") as f:
-                page_items = json.load(f)
-            logger.info(f"  ✓ JSON cargado: {len(page_items)} items detectados")
-            logger.debug(f"  Primeros 3 items: {page_items[:3]}")
-        except Exception as e:
-            logger.error(f"❌ No se pudo leer {current_page_json}: {e}")
-            error_count += 1
-            continue
-
-        # Asegura 'page'
-        for it in page_items:
-            if "page" not in it:
-                it["page"] = page_idx
-
-        # Resumen/embedding por página (muy corto, opcional)
-        page_resumen = f"Página {page_idx} del documento {master_id} (grupo {group_id})."
-        logger.debug(f"  Resumen generado: {page_resumen}")
-        
-        page_embedding = (model.encode(page_resumen).tolist() if model else [])
-        if model:
-            logger.debug(f"  Embedding generado: {len(page_embedding)} dimensiones")
-
-        page_json_layout_sql = json.dumps(page_items, ensure_ascii=False)
-        page_archivo = os.path.basename(current_page_json)
-
-        # Escribir page-level con document_version_id y document_page_id
-        logger.info(f"💾 Escribiendo en {TABLE_NAME}...")
-        if cur and page_id is not None:
-            payload_page = {
-                "document_version_id": version_id,
-                "document_page_id": page_id,
-                "document_group_id": group_id,
-                "resumen": page_resumen,
-                "json_layout": page_json_layout_sql,
-                "embedding": json.dumps(page_embedding),  # por compatibilidad si embedding no es jsonb
-                "archivo": page_archivo,
-            }
-            logger.debug(f"  Payload keys: {list(payload_page.keys())}")
-            ok = delete_then_insert_dynamic(cur, TABLE_NAME, "document_page_id", page_id, payload_page, page_cols)
-            DB_WRITE_OK = DB_WRITE_OK and ok
-            if ok:
-                processed_count += 1
-            else:
-                error_count += 1
-        else:
-            logger.warning("  ⚠️ No se puede escribir: cur o page_id es None")
-
-        # ------------- B) Recolectar TODAS las páginas del mismo master_id/version_id/group_id -------------
-        logger.info("🔍 Buscando todas las páginas del mismo documento...")
-        all_items: List[Dict[str, Any]] = []
-        try:
-            candidates = []
-            for f in os.listdir(JSON_FOLDER):
-                if not (f.startswith("documento_") and f.endswith(".json")):
-                    continue
-                nx = f[:-5]
-                # documento_{master_id}_{version_id}_{page_id}_{group_id}_pNNNN
-                # group_id puede ser número o "loose"
-                m_any = re.match(r"^documento_(\d+)_(\d+)_(\d+)_(\w+)_p(\d+)$", nx)
-                if not m_any:
-                    continue
-                
-                # Extraer y comparar master_id, version_id
-                file_master = int(m_any.group(1))
-                file_version = int(m_any.group(2))
-                file_group_str = m_any.group(4)
-                
-                # Convertir file_group_id igual que group_id
-                file_group_id = int(file_group_str) if file_group_str.isdigit() else None
-                
-                # Comparar todos los IDs
-                if file_master != master_id or file_version != version_id or file_group_id != group_id:
-                    continue
-                    
-                candidates.append((f, int(m_any.group(5))))
-
-            candidates.sort(key=lambda x: x[1])
-            logger.info(f"  ✓ Encontradas {len(candidates)} páginas para master={master_id}, version={version_id}, group={group_id}")
-            logger.debug(f"  Páginas: {[pg for _, pg in candidates]}")
-
-            for f, pg in candidates:
-                ppath = os.path.join(JSON_FOLDER, f)
-                try:
-                    with open(ppath, "r", encoding="utf-8") as fh:
-                        itms = json.load(fh)
-                    logger.debug(f"    ✓ Página {pg}: {len(itms)} items")
-                    for it in itms:
-                        it = dict(it)
-                        it.setdefault("page", pg)
-                        all_items.append(it)
-                except Exception as e:
-                    logger.error(f"❌ No se pudo leer {ppath}: {e}")
-        except Exception as e:
-            logger.error(f"❌ Error listando páginas: {e}")
-            # en caso extremo, al menos usa la página actual
-            all_items = page_items[:]
-
-        if not all_items:
-            logger.warning("⚠️ No hay items para consolidar en doc-level, saltando...")
-            continue
-
-        logger.info(f"  ✓ Total items consolidados: {len(all_items)}")
-
-        # ------------- C) Construir json_global y resumen global (doc-level) -------------
-        logger.info("🏗️ Construyendo json_global y resumen consolidado...")
-        json_global = build_json_global(all_items)
-        logger.info(f"  ✓ json_global construido: {len(json_global)} labels únicos")
-        logger.debug(f"  Labels: {list(json_global.keys())}")
-        
-        resumen = build_resumen(json_global)
-        logger.info(f"  ✓ Resumen generado: {len(resumen)} caracteres")
-        logger.debug(f"  Resumen preview: {resumen[:200]}...")
-        
-        embedding_resumen = (model.encode(resumen).tolist() if model else [])
-        if model:
-            logger.debug(f"  ✓ Embedding del resumen: {len(embedding_resumen)} dimensiones")
-        json_layout_global_sql = json.dumps(all_items, ensure_ascii=False)
-        json_global_sql = json.dumps(json_global, ensure_ascii=False)
-
-        # (opcional) archivo global auxiliar
-        if WRITE_GLOBAL_FILE:
-            out_global = os.path.join(JSON_FOLDER, f"documento_{master_id}_{version_id}_{group_id}_global.json")
-            try:
-                with open(out_global, "w", encoding="utf-8") as g:
-                    json.dump(json_global, g, ensure_ascii=False, indent=2)
-                logger.info(f"  ✓ Archivo global escrito: {out_global}")
-            except Exception as e:
-                logger.error(f"❌ No se pudo escribir {out_global}: {e}")
-
-        # ------------- D) Escribir doc-level en semantic_doc_index -------------
-        logger.info(f"💾 Escribiendo en {DOC_TABLE_NAME}...")
-        if cur:
-            payload_doc = {
-                "document_version_id": version_id,
-                "document_group_id": group_id,
-                "resumen": resumen,
-                "json_layout": json_layout_global_sql,
-                "json_global": json_global_sql,
-                "embedding": json.dumps(embedding_resumen),
-                "archivo": page_archivo,
-                "updated_at": datetime.utcnow().isoformat(),  # si no existe, se ignora
-                "created_at": datetime.utcnow().isoformat(),  # si no existe, se ignora
-            }
-            logger.debug(f"  Payload doc-level: {list(payload_doc.keys())}")
-            ok = delete_then_insert_dynamic(cur, DOC_TABLE_NAME, "document_version_id", version_id, payload_doc, doc_cols)
-            DB_WRITE_OK = DB_WRITE_OK and ok
-            if ok:
-                logger.info(f"✅ Doc-level actualizado (master={master_id}, version={version_id}, group={group_id})")
-            else:
-                error_count += 1
+    # reindexación en bloque: upserts multi-fila con commit cada SEM_BATCH_SIZE filas
+    writer = BatchWriter(cur, conn, BATCH_SIZE)
+    processed_count, error_count, DB_WRITE_OK = process_files(targets, cur, model, page_cols, doc_cols,
+                                                              writer=writer)
 
     # Commit/cierre
     logger.info("="*80)
@@ -0,0 +1,146 @@
+# topology.py — reparto de núcleos entre torch, tesseract y poppler
+# -----------------------------------------------------------------------------
+# Con la configuración por defecto cada etapa cree tener la máquina entera: torch abre un
+# hilo intra-op por núcleo (y uno por cada forward concurrente), cada proceso tesseract
+# abre su equipo OpenMP y los pdftoppm corren encima. Con varias /procesar/ a la vez eso
+# sobre-suscribe los núcleos. Aquí se decide un presupuesto por etapa y por worker:
+#   - tesseract: OCR_WORKERS procesos x CPU_OCR_THREADS hilos (OMP_THREAD_LIMIT en cada worker,
+#                o en el propio proceso con OCR_WORKERS=0);
+#   - poppler:   POPPLER_THREADS procesos pdftoppm de un hilo;
+#   - torch:     el resto, dividido entre los forwards que pueden correr a la vez (uno con el
+#                scheduler; PROCESS_WORKERS + PIPELINE_WORKERS sin él) -> torch.set_num_threads;
+#                con PRED_BACKEND=onnx el forward lo hace ONNX Runtime con ese mismo presupuesto
+#                (intra_op = hilos por forward, inter_op = 1; ORT_THREADS lo fija a mano).
+# CPU_TORCH_THREADS fija el valor por worker a mano. Con CPU_PIN=1 cada etapa además queda
+# fijada (sched_setaffinity) a su propio conjunto de núcleos; si no alcanzan, comparten.
+# main.py llama a configure() al arrancar, lo registra en el log y /health/ lo muestra en "cpu".
+# -----------------------------------------------------------------------------
+import os
+from typing import Any, Dict, List, Optional
+
+# ======== Config (override por ENV) ========
+CPU_CORES         = int(os.getenv("CPU_CORES", "0"))          # 0 = núcleos disponibles para el proceso
+CPU_TORCH_THREADS = int(os.getenv("CPU_TORCH_THREADS", "0"))  # hilos intra-op por forward (0 = auto)
+CPU_OCR_THREADS   = int(os.getenv("CPU_OCR_THREADS", "1"))    # OMP_THREAD_LIMIT de cada tesseract
+CPU_PIN           = os.getenv("CPU_PIN", "0") == "1"          # fijar cada etapa a sus núcleos
+ORT_THREADS       = int(os.getenv("ORT_THREADS", "0"))        # intra-op de ONNX Runtime (0 = los de torch)
+
+
+def _log(*a):
+    print("[topology]", *a, flush=True)
+
+
+def available_cores() -> List[int]:
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:  # sin sched_getaffinity (no Linux)
+        return list(range(os.cpu_count() or 1))
+
+
+def _set_affinity(cores: List[int]) -> None:
+    # en Linux afecta al hilo que llama; los procesos hijos lo heredan
+    if not cores or not hasattr(os, "sched_setaffinity"):
+        return
+    try:
+        os.sched_setaffinity(0, cores)
+    except OSError as e:
+        _log(f"AVISO: no se pudo fijar afinidad {cores}: {e}")
+
+
+class Layout:
+    def __init__(self, cores: List[int], ocr_workers: int, ocr_threads: int, poppler_threads: int,
+                 forward_workers: int, torch_threads: int = 0, pin: bool = False, ort_threads: int = 0):
+        self.cores = cores
+        self.ocr_workers = max(0, ocr_workers)
+        self.ocr_threads = max(1, ocr_threads)
+        self.poppler_threads = max(1, poppler_threads)
+        self.forward_workers = max(1, forward_workers)
+        self.pin = pin
+
+        n = len(cores)
+        n_ocr = self.ocr_workers * self.ocr_threads
+        n_torch = max(1, n - n_ocr - self.poppler_threads)
+        self.torch_threads = torch_threads if torch_threads > 0 else max(1, n_torch // self.forward_workers)
+        # ONNX Runtime sustituye a torch en el forward: mismo presupuesto salvo ORT_THREADS
+        self.ort_threads = ort_threads if ort_threads > 0 else self.torch_threads
+
+        # núcleos por etapa: torch primero, luego tesseract y poppler; si no alcanzan, comparten
+        if n_torch + n_ocr + self.poppler_threads <= n:
+            self.torch_cores = cores[:n_torch]
+            self.ocr_cores = cores[n_torch:n_torch + n_ocr]
+            self.poppler_cores = cores[n_torch + n_ocr:n_torch + n_ocr + self.poppler_threads]
+        else:
+            self.torch_cores = self.ocr_cores = self.poppler_cores = cores
+
+    def oversubscribed(self) -> bool:
+        forward = max(self.torch_threads, self.ort_threads)
+        demand = forward * self.forward_workers + self.ocr_workers * self.ocr_threads + self.poppler_threads
+        return demand > len(self.cores)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "nucleos": len(self.cores),
+            "fijado": self.pin,
+            "torch": {"hilos_por_forward": self.torch_threads, "forwards": self.forward_workers,
+                      "nucleos": self.torch_cores if self.pin else None},
+            "onnxruntime": {"intra_op": self.ort_threads, "inter_op": 1},
+            "tesseract": {"procesos": self.ocr_workers, "hilos_por_proceso": self.ocr_threads,
+                          "nucleos": self.ocr_cores if self.pin else None},
+            "poppler": {"procesos": self.poppler_threads,
+                        "nucleos": self.poppler_cores if self.pin else None},
+            "sobresuscrito": self.oversubscribed(),
+        }
+
+
+_LAYOUT: Optional[Layout] = None
+
+
+def configure(ocr_workers: int, poppler_threads: int, forward_workers: int) -> Layout:
+    """Calcula el reparto, fija los hilos de torch (y la afinidad del proceso con CPU_PIN)."""
+    global _LAYOUT
+    cores = available_cores()
+    if CPU_CORES > 0:
+        cores = cores[:CPU_CORES]
+    layout = Layout(cores, ocr_workers, CPU_OCR_THREADS, poppler_threads, forward_workers,
+                    CPU_TORCH_THREADS, CPU_PIN, ORT_THREADS)
+
+    import torch  # aquí y no arriba: los workers de OCR importan este módulo sin torch
+    torch.set_num_threads(layout.torch_threads)
+    if layout.pin:
+        # hilos de la API, forwards de torch y sus equipos OpenMP heredan estos núcleos
+        _set_affinity(layout.torch_cores)
+
+    _LAYOUT = layout
+    _log(f"reparto de CPU: {layout.as_dict()}")
+    if layout.oversubscribed():
+        _log("AVISO: la demanda de hilos supera los núcleos disponibles")
+    return layout
+
+
+def current() -> Optional[Layout]:
+    return _LAYOUT
+
+
+def ort_threads() -> int:
+    """intra_op_num_threads para las sesiones de ONNX Runtime (0 = sin reparto: decide ORT)."""
+    return _LAYOUT.ort_threads if _LAYOUT is not None else ORT_THREADS
+
+
+def ocr_worker_init(cores: List[int], threads: int) -> None:
+    """Initializer de cada proceso del pool de OCR (tesseract hereda el entorno y la afinidad)."""
+    os.environ["OMP_THREAD_LIMIT"] = str(threads)
+    _set_affinity(cores)
+
+
+def in_process_ocr_init(threads: int) -> None:
+    """OCR_WORKERS=0: tesseract corre desde este proceso; solo se limita su OpenMP (sin afinidad)."""
+    os.environ["OMP_THREAD_LIMIT"] = str(max(1, threads))
+
+
+def poppler_thread_init(cores: List[int]) -> None:
+    """Initializer de cada hilo del pool de poppler: los pdftoppm que lanza heredan su afinidad."""
+    _set_affinity(cores)
+
+
+def stats() -> Optional[Dict[str, Any]]:
+    return _LAYOUT.as_dict() if _LAYOUT is not None else None
@@ -0,0 +1,67 @@
+# transport.py — envío binario de páginas (sin base64) escrito a medida que se generan
+# -----------------------------------------------------------------------------
+# zip_stream():       ZIP sin compresión (ZIP_STORED; el PNG ya viene comprimido). Se
+#                     escribe sobre un destino no "seekable", así que cada entrada usa
+#                     data descriptor y el directorio central va al final.
+# multipart_stream(): multipart/mixed, una parte image/png por página.
+# Ambos entregan bytes página a página: nunca se arma la respuesta completa en memoria.
+# -----------------------------------------------------------------------------
+import json
+import time
+import uuid
+import zipfile
+from typing import Iterator, List, Tuple
+
+
+class _ChunkSink:
+    """Destino de escritura sin tell()/seek(): zipfile entra en modo streaming."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def zip_stream(pages: Iterator[Tuple[str, bytes]]) -> Iterator[bytes]:
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as zf:
+        try:
+            for filename, data in pages:
+                info = zipfile.ZipInfo(filename, date_time=time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                zf.writestr(info, data)
+                yield sink.drain()
+        except Exception as e:
+            zf.writestr("error.json", json.dumps({"error": str(e)}))
+    # close() escribe el directorio central
+    yield sink.drain()
+
+
+def multipart_boundary() -> str:
+    return f"validocu-{uuid.uuid4().hex}"
+
+
+def multipart_stream(pages: Iterator[Tuple[str, bytes]], boundary: str) -> Iterator[bytes]:
+    delim = f"--{boundary}\r\n".encode()
+    try:
+        for filename, data in pages:
+            headers = (
+                "Content-Type: image/png\r\n"
+                f'Content-Disposition: attachment; filename="{filename}"\r\n'
+                f"Content-Length: {len(data)}\r\n\r\n"
+            ).encode()
+            yield delim + headers + data + b"\r\n"
+    except Exception as e:
+        body = json.dumps({"error": str(e)}).encode()
+        yield delim + b"Content-Type: application/json\r\n\r\n" + body + b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
@@ -0,0 +1,111 @@
+# validar_backend.py — exporta y valida un backend de inferencia (int8 / onnx) contra el fp32
+# -----------------------------------------------------------------------------
+# Corre las páginas de referencia (imágenes de una carpeta, con el mismo OCR que /procesar/)
+# por el modelo fp32 y por el backend candidato, en modo completo y solo texto, y compara
+# las entidades agrupadas (etiqueta, texto y cajas). Solo si todas coinciden escribe la
+# validación que permite activarlo con PRED_BACKEND (ver app/backends.py).
+#
+#   python -m app.validar_backend --backend onnx --exportar \
+#       --paginas outputs/referencia --modelo outputs/modelo_multiclase
+#
+# --tolerancia permite aceptar hasta N páginas distintas con diferencias, en cualquier modo
+# (por defecto 0).
+# -----------------------------------------------------------------------------
+import argparse
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image
+
+from app import backends, prediccion
+
+MODOS = {"completo": False, "texto": True}
+EXTENSIONES = (".png", ".jpg", ".jpeg", ".tif", ".tiff")
+
+
+def _entidades(bundle: prediccion.ModelBundle, img: Image.Image, words, boxes, text_only: bool, conf_thresh: float):
+    t0 = time.perf_counter()
+    pred_ids, confs = prediccion._predict_page(bundle, img, words, boxes, text_only=text_only)
+    dt = time.perf_counter() - t0
+    W, H = img.size
+    return prediccion._group_entities(words, boxes, pred_ids, confs, bundle.id2label, W, H, conf_thresh), dt
+
+
+def validar(paginas: List[str], model_dir: str, backend: str, conf_thresh: float, exportar: bool = False) -> Dict:
+    # fp32 fuera del registro: el registro activaría PRED_BACKEND
+    referencia = prediccion.ModelBundle(*prediccion._load_model_and_processor(model_dir))
+    if exportar and backend == "onnx":
+        backends.export_onnx(referencia.model, referencia.processor, model_dir, prediccion.DEFAULT_MAX_LENGTH)
+        referencia = referencia._replace(model=referencia.model.to(referencia.device))
+    candidato = referencia._replace(model=backends.build(referencia.model, model_dir, backend), backend=backend)
+
+    tiempos = {"eager": [], backend: []}
+    diferencias, entidades = [], 0
+    for ruta in paginas:
+        img = Image.open(ruta).convert("RGB")
+        words, boxes = prediccion._ocr_words_boxes(img)
+        if not words:
+            continue
+        for modo, text_only in MODOS.items():
+            esperado, t_ref = _entidades(referencia, img, words, boxes, text_only, conf_thresh)
+            obtenido, t_cand = _entidades(candidato, img, words, boxes, text_only, conf_thresh)
+            tiempos["eager"].append(t_ref)
+            tiempos[backend].append(t_cand)
+            entidades += len(esperado)
+            if esperado != obtenido:
+                diferencias.append({"pagina": os.path.basename(ruta), "modo": modo,
+                                    "esperadas": len(esperado), "obtenidas": len(obtenido),
+                                    "distintas": len([e for e in esperado if e not in obtenido])
+                                                 + len([e for e in obtenido if e not in esperado])})
+
+    return {
+        "paginas": len(paginas),
+        "entidades": entidades,
+        "diferencias": len(diferencias),                                # pares (página, modo)
+        "paginas_con_diferencias": len({d["pagina"] for d in diferencias}),
+        "detalle": diferencias,
+        "latencia_ms": {k: round(float(np.mean(v)) * 1000.0, 1) if v else None for k, v in tiempos.items()},
+    }
+
+
+def _paginas(carpeta: str, limite: int) -> List[str]:
+    rutas = sorted(os.path.join(carpeta, n) for n in os.listdir(carpeta) if n.lower().endswith(EXTENSIONES))
+    return rutas[:limite] if limite else rutas
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Exporta/valida un backend de inferencia contra el modelo fp32")
+    ap.add_argument("--backend", required=True, choices=[b for b in backends.BACKENDS if b != "eager"])
+    ap.add_argument("--paginas", required=True, help="carpeta con imágenes de páginas de referencia")
+    ap.add_argument("--modelo", default=prediccion.DEFAULT_MODEL_DIR)
+    ap.add_argument("--conf", type=float, default=prediccion.DEFAULT_CONF_THRESH)
+    ap.add_argument("--limite", type=int, default=0, help="máximo de páginas (0 = todas)")
+    ap.add_argument("--exportar", action="store_true", help="(onnx) exporta los grafos antes de validar")
+    ap.add_argument("--tolerancia", type=int, default=0, help="páginas distintas con diferencias aceptadas (en cualquier modo)")
+    args = ap.parse_args()
+
+    paginas = _paginas(args.paginas, args.limite)
+    if not paginas:
+        raise SystemExit(f"sin imágenes de referencia en {args.paginas}")
+    reporte = validar(paginas, args.modelo, args.backend, args.conf, args.exportar)
+    reporte["ok"] = reporte["paginas_con_diferencias"] <= args.tolerancia
+
+    print(f"\nPáginas: {reporte['paginas']}  Entidades fp32: {reporte['entidades']}  "
+          f"Páginas con diferencias: {reporte['paginas_con_diferencias']} "
+          f"({reporte['diferencias']} página/modo)")
+    for d in reporte["detalle"]:
+        print(f"  {d['pagina']} ({d['modo']}): {d['distintas']} entidades distintas")
+    print(f"Latencia media por página (ms): {reporte['latencia_ms']}")
+
+    path = backends.write_marker(args.modelo, args.backend, prediccion.checkpoint_version(args.modelo), reporte)
+    if reporte["ok"]:
+        print(f"\n✅ {args.backend} validado: {path} (activar con PRED_BACKEND={args.backend})")
+    else:
+        print(f"\n❌ {args.backend} NO validado: {path}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@
 use App\Traits\CreatesDocumentAuditLogs;
 use Illuminate\Contracts\Queue\ShouldQueue;
 use Illuminate\Foundation\Queue\Queueable;
+use Illuminate\Http\Client\RequestException;
 use Illuminate\Http\JsonResponse;
 use Illuminate\Support\Facades\DB;
 use Illuminate\Support\Facades\Http;
@@ -169,9 +170,9 @@ private function addDocumentsToGroup(): void {
                 }
 
                 // === CREAR semantic_doc_index SI NO EXISTE ===
-                $exists = DB::table('semantic_doc_index')->where('document_version_id', $document->versionId)->exists();
-                if (!$exists) {
-                    DB::table('semantic_doc_index')->insert([
+                // ON CONFLICT DO NOTHING: si el servicio IA ya consolidó la versión, se respeta su fila
+                try {
+                    DB::table('semantic_doc_index')->insertOrIgnore([
                         'document_version_id' => $document->versionId,
                         'document_group_id' => $this->group ? $this->group->id : null,
                         'json_layout' => null,
@@ -180,6 +181,8 @@ private function addDocumentsToGroup(): void {
                         'created_at' => now(),
                         'updated_at' => now(),
                     ]);
+                } catch (\Exception $e) {
+                    Log::error("Error creando semantic_doc_index: " . $e->getMessage());
                 }
 
                 // Actualizar notificación respectiva
@@ -288,14 +291,24 @@ private function saveImages(
             try {
                 $absolutePath = storage_path('app/public/' . $imgPath);
 
-                $response = Http::attach(
-                    'file', fopen($absolutePath, 'r'), $newFilename
+                $response = Http::retry(
+                    5,
+                    // FastAPI responde 429 + Retry-After cuando su cola está llena
+                    fn (int $attempt, \Exception $e) => $e instanceof RequestException
+                        ? max(1, (int) $e->response->header('Retry-After')) * 1000
+                        : 1000,
+                    fn (\Exception $e) => $e instanceof RequestException && $e->response->status() === 429,
+                    throw: false
+                )->attach(
+                    'file', file_get_contents($absolutePath), $newFilename
                 )->post('http://localhost:5050/procesar/', [
                     'master_id' => $document_master_id,
                     'version_id' => $version_id,
                     'page_id' => $page,
                     'group_id' => $this->group ? $this->group->id : null,
-                    'page' => $pageNumber
+                    'page' => $pageNumber,
+                    // total de páginas: la última consolida semantic_doc_index antes de responder
+                    'paginas' => count($images)
                 ]);
 
                 if (!$response->successful()) {
@@ -10,6 +10,7 @@
 use App\Traits\CreatesDocumentAuditLogs;
 use Illuminate\Contracts\Queue\ShouldQueue;
 use Illuminate\Foundation\Queue\Queueable;
+use Illuminate\Http\Client\RequestException;
 use Illuminate\Http\JsonResponse;
 use Illuminate\Support\Facades\DB;
 use Illuminate\Support\Facades\Http;
@@ -149,20 +150,17 @@ private function addNewVersion(): void
 
             // 8. Crear entrada en semantic_doc_index
             try {
-                $exists = DB::table('semantic_doc_index')
-                    ->where('document_version_id', $version->id)
-                    ->exists();
-                    
-                if (!$exists) {
-                    DB::table('semantic_doc_index')->insert([
-                        'document_version_id' => $version->id,
-                        'document_group_id' => $this->document->document_group_id,
-                        'json_layout' => null,
-                        'json_global' => null,
-                        'resumen' => null,
-                        'created_at' => now(),
-                        'updated_at' => now(),
-                    ]);
+                // ON CONFLICT DO NOTHING: si el servicio IA ya consolidó la versión, se respeta su fila
+                $inserted = DB::table('semantic_doc_index')->insertOrIgnore([
+                    'document_version_id' => $version->id,
+                    'document_group_id' => $this->document->document_group_id,
+                    'json_layout' => null,
+                    'json_global' => null,
+                    'resumen' => null,
+                    'created_at' => now(),
+                    'updated_at' => now(),
+                ]);
+                if ($inserted) {
                     Log::info("Entrada en semantic_doc_index creada para versión {$version->id}");
                 }
             } catch (\Exception $e) {
@@ -259,11 +257,21 @@ private function saveImages(
                     'version_id' => $version_id,
                     'page_id' => $page,
                     'group_id' => $this->document->document_group_id,
-                    'page' => $pageNumber
+                    'page' => $pageNumber,
+                    // total de páginas: la última consolida semantic_doc_index antes de responder
+                    'paginas' => count($images)
                 ];
                 Log::info("payload: " . json_encode($payload));
-                $response = Http::attach(
-                    'file', fopen($absolutePath, 'r'), $newFilename
+                $response = Http::retry(
+                    5,
+                    // FastAPI responde 429 + Retry-After cuando su cola está llena
+                    fn (int $attempt, \Exception $e) => $e instanceof RequestException
+                        ? max(1, (int) $e->response->header('Retry-After')) * 1000
+                        : 1000,
+                    fn (\Exception $e) => $e instanceof RequestException && $e->response->status() === 429,
+                    throw: false
+                )->attach(
+                    'file', file_get_contents($absolutePath), $newFilename
                 )->post('http://localhost:5050/procesar/', $payload);
 
                 if (!$response->successful()) {
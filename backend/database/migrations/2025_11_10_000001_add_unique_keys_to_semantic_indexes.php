@@ -0,0 +1,57 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\DB;
+use Illuminate\Support\Facades\Schema;
+
+/**
+ * Claves únicas para el upsert del servicio IA (INSERT ... ON CONFLICT DO UPDATE):
+ * una fila de semantic_index por página y una de semantic_doc_index por versión.
+ * Antes de crearlas se eliminan duplicados, conservando la fila más reciente.
+ */
+return new class extends Migration
+{
+    /**
+     * Run the migrations.
+     */
+    public function up(): void
+    {
+        DB::statement('
+            DELETE FROM semantic_index a
+            USING semantic_index b
+            WHERE a.document_page_id = b.document_page_id AND a.id < b.id
+        ');
+        DB::statement('
+            DELETE FROM semantic_doc_index a
+            USING semantic_doc_index b
+            WHERE a.document_version_id = b.document_version_id AND a.id < b.id
+        ');
+
+        Schema::table('semantic_index', function (Blueprint $table) {
+            $table->dropIndex('idx_semidx_page');
+            $table->unique('document_page_id', 'uq_semidx_page');
+        });
+
+        Schema::table('semantic_doc_index', function (Blueprint $table) {
+            $table->dropIndex('idx_semdocidx_version');
+            $table->unique('document_version_id', 'uq_semdocidx_version');
+        });
+    }
+
+    /**
+     * Reverse the migrations.
+     */
+    public function down(): void
+    {
+        Schema::table('semantic_index', function (Blueprint $table) {
+            $table->dropUnique('uq_semidx_page');
+            $table->index('document_page_id', 'idx_semidx_page');
+        });
+
+        Schema::table('semantic_doc_index', function (Blueprint $table) {
+            $table->dropUnique('uq_semdocidx_version');
+            $table->index('document_version_id', 'idx_semdocidx_version');
+        });
+    }
+};